@@ -0,0 +1,188 @@
+"""
+
+Example:
+from bufferpool import frame_pool
+frame = frame_pool.get_buffer(len(jpeg))    # refcount 1, owned by the caller
+frame.write(jpeg)
+viewer_copy = frame.acquire()              # every holder takes a reference...
+viewer_copy.release()                      # ...and gives it back; the last one returns it to the pool
+frame.release()
+image = frame_pool.get_image((540, 960, 3))
+image.release()
+
+"""
+
+import gc
+import os
+import threading
+
+import numpy as np
+
+from telemetry import RateCounter
+
+MIN_BUFFER_SIZE = 64 * 1024
+
+
+class Pooled:
+    def __init__(self, pool, key, data):
+        """
+        A buffer handed out by a BufferPool. Starts with one reference held by
+        whoever got it from the pool; it goes back to the pool when the last
+        reference is released.
+        """
+        self.pool = pool
+        self.key = key
+        self.data = data
+        self._refs = 0
+
+    def acquire(self):
+        with self.pool._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self.pool._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            if self._refs < 0:
+                raise RuntimeError("Pooled buffer released more times than acquired.")
+            self.pool._put(self)
+
+
+class PooledBuffer(Pooled):
+    """
+    Byte buffer (an encoded JPEG). Only the first `length` bytes are used.
+    """
+
+    def __init__(self, pool, key, data):
+        super().__init__(pool, key, data)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def view(self):
+        return memoryview(self.data)[:self.length]
+
+    def write(self, data):
+        length = len(data)
+        memoryview(self.data)[:length] = data
+        self.length = length
+        return self
+
+
+class PooledImage(Pooled):
+    """
+    Image array. `data` is the ndarray.
+    """
+
+
+class BufferPool:
+    def __init__(self, max_free=8):
+        """
+        Reusable byte buffers and image arrays for the frame path: capture,
+        decode, encode and streaming take buffers from here instead of
+        allocating new ones for every frame.
+
+        Byte buffers are rounded up to a power of two so frames of slightly
+        different sizes share buffers. Images are pooled by shape and dtype.
+
+        Parameters:
+        max_free (int): Free buffers kept per size. Extra ones are left to the garbage collector.
+        """
+        self.max_free = max_free
+        self._lock = threading.Lock()
+        self._free = {}  # key -> [Pooled]
+        self.requests = 0
+        self.allocations = 0
+        self.allocated_bytes = 0
+        self.in_use = 0
+        self.allocation_rate = RateCounter()
+
+    def get_buffer(self, size):
+        capacity = MIN_BUFFER_SIZE
+        while capacity < size:
+            capacity *= 2
+        return self._get(('bytes', capacity), lambda key: PooledBuffer(self, key, bytearray(capacity)))
+
+    def get_image(self, shape, dtype=np.uint8):
+        dtype = np.dtype(dtype)
+        return self._get(('image', tuple(shape), dtype.str),
+                         lambda key: PooledImage(self, key, np.empty(shape, dtype=dtype)))
+
+    def _get(self, key, allocate):
+        with self._lock:
+            self.requests += 1
+            self.in_use += 1
+            free = self._free.get(key)
+            if free:
+                item = free.pop()
+                item._refs = 1
+                if isinstance(item, PooledBuffer):
+                    item.length = 0
+                return item
+            self.allocations += 1
+        self.allocation_rate.add()
+        item = allocate(key)
+        with self._lock:
+            self.allocated_bytes += item.data.nbytes if isinstance(item.data, np.ndarray) else len(item.data)
+        item._refs = 1
+        return item
+
+    def _put(self, item):
+        # Called with the lock held
+        self.in_use -= 1
+        free = self._free.setdefault(item.key, [])
+        if len(free) < self.max_free:
+            free.append(item)
+        else:
+            self.allocated_bytes -= item.data.nbytes if isinstance(item.data, np.ndarray) else len(item.data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'allocations': self.allocations,
+                # fraction of requests that had to allocate; near 0 once warmed up
+                'allocations_per_request': self.allocations / self.requests if self.requests else 0.0,
+                'in_use': self.in_use,
+                'free': sum(len(free) for free in self._free.values()),
+                'pooled_mb': self.allocated_bytes / 1e6,
+            }
+
+
+def memory_stats():
+    """
+    Resident memory of this process and garbage collector activity.
+    """
+    rss_mb = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss_mb = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, IndexError):
+        pass
+    return {
+        'rss_mb': rss_mb,
+        'gc_collections': [generation['collections'] for generation in gc.get_stats()],
+    }
+
+
+# Shared by every camera and stream in this process
+frame_pool = BufferPool()
+
+
+# Test: python bufferpool.py
+if __name__ == "__main__":
+    pool = BufferPool()
+    payload = bytes(100_000)
+    for _ in range(100):
+        frame = pool.get_buffer(len(payload)).write(payload)
+        viewers = [frame.acquire() for _ in range(3)]
+        frame.release()
+        for viewer in viewers:
+            viewer.release()
+        image = pool.get_image((540, 960, 3))
+        image.release()
+    print(pool.stats())
+    print(memory_stats())
@@ -1,85 +1,186 @@
 import cv2
+import time
 import platform
 import subprocess
 import numpy as np
 
+from log import get_logger, fields, setup_logging
+from bufferpool import frame_pool, PooledBuffer, PooledImage
+
+logger = get_logger(__name__)
+
+MAX_FRAME_SIZE = 1_000_000  # bytes; a libcamera frame larger than this is discarded
+READ_SIZE = 64 * 1024       # most bytes taken from the libcamera-vid pipe per read
+
 class CameraHandler:
-    def __init__(self, width=1920, height=1080, fps=30):
+    def __init__(self, width=1920, height=1080, fps=30, camera_index=0, source=None):
+        """
+        Parameters:
+        width (int), height (int), fps (int): Capture resolution and frame rate.
+        camera_index (int): Which camera to open: libcamera's --camera index, or the
+                            OpenCV device index for USB cameras.
+        source (str): 'libcamera' or 'opencv'. Defaults to libcamera on Linux and OpenCV on macOS.
+        """
         self.system = platform.system()
         self.cap = None
         self.process = None
         self.width = width
         self.height = height
         self.fps = fps
+        self.camera_index = camera_index
+        # Frames are assembled here, then copied into a pooled buffer of their own size
+        self._linux_buffer = bytearray(MAX_FRAME_SIZE + READ_SIZE)
+        self._linux_buffer_len = 0
+        self._linux_buffer_at = None
+        self._opencv_buffer = None
+        # time.monotonic() when the last frame returned by get_frame started arriving
+        self.captured_at = None
+
+        if source is None:
+            if self.system == "Linux":
+                source = 'libcamera'
+            elif self.system == "Darwin":
+                source = 'opencv'
+            else:
+                raise NotImplementedError(f"Unsupported system: {self.system}")
+        self.source = source
 
-        if self.system == "Linux":
+        if self.source == 'libcamera':
             self.init_linux_camera()
-        elif self.system == "Darwin":
-            self.init_macos_camera()
+        elif self.source == 'opencv':
+            self.init_opencv_camera()
         else:
-            raise NotImplementedError(f"Unsupported system: {self.system}")
+            raise ValueError(f"Unknown camera source: {self.source}")
 
     def init_linux_camera(self):
         # Set up for libcamera-vid with additional parameters
         self.process = subprocess.Popen(
             ['libcamera-vid', '--codec', 'mjpeg', '--inline', '-o', '-', '-t', '0', 
+             '--camera', str(self.camera_index),
              '--width', str(self.width), '--height', str(self.height), '--framerate', str(self.fps)],
             stdout=subprocess.PIPE, stderr=subprocess.PIPE
         )
 
-    def init_macos_camera(self):
-        # Set up for OpenCV VideoCapture
-        self.cap = cv2.VideoCapture(0)
+    def init_opencv_camera(self):
+        # Set up for OpenCV VideoCapture (macOS or USB cameras)
+        self.cap = cv2.VideoCapture(self.camera_index)
         if not self.cap.isOpened():
-            raise Exception("Failed to open camera on macOS.")
+            raise Exception(f"Failed to open OpenCV camera {self.camera_index}.")
+        self.cap.set(cv2.CAP_PROP_FPS, self.fps)
 
     def get_still(self):
-        if self.system == "Linux":
+        if self.source == 'libcamera':
             return self.get_linux_still()
-        elif self.system == "Darwin":
-            return self.get_macos_still()
+        elif self.source == 'opencv':
+            return self.get_opencv_still()
+
+    def get_frame(self):
+        """
+        Return the next frame without decoding it when possible, in a buffer from
+        frame_pool: a PooledBuffer holding the JPEG from libcamera-vid, a
+        PooledImage holding the BGR image from OpenCV. The caller owns one
+        reference and releases it when done.
+        """
+        if self.source == 'libcamera':
+            return self.get_linux_jpeg()
+        elif self.source == 'opencv':
+            return self.get_opencv_frame()
+
+    @staticmethod
+    def decode_frame(frame):
+        """
+        Decode a frame (JPEG bytes, PooledBuffer, PooledImage or image) into a BGR image.
+        """
+        if isinstance(frame, PooledImage):
+            return frame.data
+        if isinstance(frame, np.ndarray):
+            return frame
+        if isinstance(frame, PooledBuffer):
+            frame = frame.view()
+        return cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR)
 
     def get_linux_still(self):
+        while True:
+            frame = self.get_linux_jpeg()
+            if frame is None:
+                return None
+            decoded_frame = self.decode_frame(frame)
+            frame.release()
+            if decoded_frame is not None:
+                return decoded_frame
+
+    def get_linux_jpeg(self):
         if not self.process:
             raise Exception("Linux camera process is not initialized.")
 
-        buffer = b''
+        # Read straight into the assembly buffer, no new bytes per read
+        buffer = self._linux_buffer
+        view = memoryview(buffer)
+        filled = self._linux_buffer_len
+        # The first bytes of a frame off the pipe are the earliest we can see of it
+        started_at = self._linux_buffer_at if filled else None
+        searched = 0
         while True:
-            chunk = self.process.stdout.read(1024)
-            if not chunk:
-                print("No more data from libcamera-vid.")
-                break
-            buffer += chunk
-            end = buffer.find(b'\xff\xd9')  # JPEG end of image marker
+            # JPEG end of image marker, searching only the new bytes (and the one before them).
+            # Bytes left from the last read can already hold a whole frame.
+            end = buffer.find(b'\xff\xd9', max(searched - 1, 0), filled)
+            searched = filled
 
             if end != -1:
-                frame = buffer[:end+2]
-                buffer = buffer[end+2:]
-                # decode image
-                decoded_frame = cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR)
-                if decoded_frame is not None:
-                    return decoded_frame
-
-            # Check if buffer is too large and reset if necessary
-            if len(buffer) > 1_000_000:
-                print("Buffer size exceeded limit, resetting buffer.")
-                buffer = b''
+                end += 2
+                frame = frame_pool.get_buffer(end).write(view[:end])
+                # keep whatever came after the marker for the next frame
+                leftover = filled - end
+                view[:leftover] = view[end:filled]
+                self._linux_buffer_len = leftover
+                self._linux_buffer_at = time.monotonic()
+                self.captured_at = started_at
+                return frame
+
+            if filled > MAX_FRAME_SIZE:
+                logger.warning("Buffer size exceeded limit, resetting buffer.", extra=fields(camera=self.camera_index, rate_limit=1))
+                filled = searched = 0
+                started_at = None
+            read = self.process.stdout.readinto1(view[filled:filled + READ_SIZE])
+            if not read:
+                logger.warning("No more data from libcamera-vid.", extra=fields(camera=self.camera_index, rate_limit=1))
+                break
+            if started_at is None:
+                started_at = time.monotonic()
+            filled += read
 
+        self._linux_buffer_len = 0
+        self._linux_buffer_at = None
         return None
 
-    def get_macos_still(self):
+    def get_opencv_frame(self):
         if not self.cap:
-            raise Exception("macOS camera is not initialized.")
+            raise Exception("OpenCV camera is not initialized.")
+
+        # Capture into the same array every time, then resize into a pooled one
+        ret, self._opencv_buffer = self.cap.read(self._opencv_buffer)
+        self.captured_at = time.monotonic()
+        if not ret:
+            logger.warning("Failed to capture image from OpenCV camera.", extra=fields(camera=self.camera_index, rate_limit=1))
+            return None
+        frame = frame_pool.get_image((self.height, self.width, 3), self._opencv_buffer.dtype)
+        cv2.resize(self._opencv_buffer, (self.width, self.height), dst=frame.data)
+        return frame
+
+    def get_opencv_still(self):
+        if not self.cap:
+            raise Exception("OpenCV camera is not initialized.")
 
         ret, frame = self.cap.read()
         if ret:
             resized_frame = cv2.resize(frame, (self.width, self.height))
             return resized_frame
         else:
-            print("Failed to capture image from macOS camera.")
+            logger.warning("Failed to capture image from OpenCV camera.", extra=fields(camera=self.camera_index, rate_limit=1))
             return None
 
-    def draw_bounding_boxes(self, image, bounding_boxes, model_input_width=320, model_input_height=320):
+    @staticmethod
+    def draw_bounding_boxes(image, bounding_boxes, model_input_width=320, model_input_height=320):
         """
             Draw circles at the center of bounding boxes on the image.
 
@@ -89,7 +190,8 @@ class CameraHandler:
         This function maps the coordinates back to the original size.
         """
 
-        min_coordinate = min(self.width, self.height)
+        # Use the image itself so this works for any camera and resolution
+        min_coordinate = min(image.shape[0], image.shape[1])
 
         for bb in bounding_boxes:
             # Only if confidence is high, plot it (?)
@@ -114,30 +216,40 @@ class CameraHandler:
 
         return image
 
+    def exited(self):
+        # libcamera-vid exits at once when it can't open the camera, e.g. while another process holds it
+        return self.source == 'libcamera' and self.process is not None and self.process.poll() is not None
+
     def shut_down(self):
-        if self.system == "Linux" and self.process:
+        if self.source == 'libcamera' and self.process:
             self.process.stdout.close()
             self.process.stderr.close()
             self.process.terminate()
-        elif self.system == "Darwin" and self.cap:
+            # Wait for the sensor to be released, so it can be opened again straight away
+            try:
+                self.process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        elif self.source == 'opencv' and self.cap:
             self.cap.release()
 
 # Test: python camera_handler.py
 if __name__ == "__main__":
+    setup_logging()
     # Initialize CameraHandler with custom resolution and frame rate
     cam = CameraHandler(width=960, height=540, fps=30)
     try:
         # Test 1: capture still
-        print("Test 1: capture still")
+        logger.info("Test 1: capture still")
         image = cam.get_still()
         if image is not None:
             # Save the captured image
             cv2.imwrite('test_images/camera_handler_test.jpg', image)
-            print("Image captured successfully.")
+            logger.info("Image captured successfully.")
 
 
         # Test 2: annotation
-        print("Test 2: annotation")
+        logger.info("Test 2: annotation")
         # image_20240805_210136
         data = {"sampleId":1127881946, "boundingBoxes":[{"label":1,"x":99,"y":115,"width":29,"height":29, "value": 0.75}]}
         image_path = 'test_images/image_to_classify.jpg'
@@ -164,7 +276,7 @@ if __name__ == "__main__":
 
             # Save the annotated image
             cv2.imwrite('test_images/bb_image_to_classify.jpg', annotated_image)
-            print("Annotated image saved successfully.")
+            logger.info("Annotated image saved successfully.")
 
     finally:
         cam.shut_down()
\ No newline at end of file
@@ -0,0 +1,557 @@
+"""
+
+Example:
+from camera_registry import CameraRegistry
+cameras = CameraRegistry()
+cameras.add('front', width=960, height=540, fps=30, camera_index=0)
+cameras.add('rear', width=640, height=480, fps=30, camera_index=1, process=True)
+cameras.add('usb', width=640, height=480, fps=30, camera_index=0, source='opencv')
+cameras.start()
+switch = cameras.get('front').reconfigure(width=640, height=360, fps=15)   # viewers keep streaming
+switch.done.wait(10)
+seq, frame, (captured_at, published_at) = cameras.get('front').wait_frame(last_seq=-1)
+frame.release()
+cameras.close()
+
+"""
+
+import time
+import threading
+import multiprocessing
+from collections import deque
+
+import cv2
+
+from camera import CameraHandler
+from bufferpool import frame_pool, PooledImage
+from log import get_logger, fields
+
+logger = get_logger(__name__)
+
+
+# Settings that can be changed with reconfigure, and their allowed range
+SETTING_LIMITS = {'width': (64, 4056), 'height': (64, 3040), 'fps': (1, 120)}
+
+
+class ReconfigureBusy(Exception):
+    pass
+
+
+def validate_settings(settings):
+    """
+    Check camera settings from a client. Returns them as ints; raises ValueError
+    for unknown or out of range settings.
+    """
+    unknown = set(settings) - set(SETTING_LIMITS)
+    if unknown:
+        raise ValueError(f"Unknown camera settings: {sorted(unknown)}")
+    checked = {}
+    for key, value in settings.items():
+        low, high = SETTING_LIMITS[key]
+        value = int(value)
+        if not low <= value <= high:
+            raise ValueError(f"{key} must be between {low} and {high}.")
+        checked[key] = value
+    return checked
+
+
+class CameraSwitch:
+    def __init__(self, handler_kwargs, timeout):
+        """
+        A change of camera settings in progress. `done` is set once viewers
+        are getting frames with the new settings, or the change failed; `result`
+        then says how it went.
+        """
+        self.handler_kwargs = handler_kwargs
+        self.timeout = timeout
+        self.requested_at = time.monotonic()
+        self.ready = threading.Event()  # the new camera delivered its first frame, or failed to
+        self.done = threading.Event()
+        self.source = None
+        self.first = None  # (frame, captured_at)
+        self.error = None
+        self.result = None
+
+
+class CameraWorker:
+    def __init__(self, camera_id, handler=None, handler_kwargs=None, factory=None):
+        """
+        Reads frames from one camera on its own thread and keeps the latest one
+        for any number of viewers, so a camera is read once no matter how many
+        streams are open.
+
+        Parameters:
+        camera_id (str): Name used in /video_feed/<camera_id>.
+        handler (CameraHandler): An already opened camera. It is kept open between stop and start.
+        handler_kwargs (dict): Arguments for CameraHandler, used to open the camera on start.
+        factory (callable): Opens a camera from handler_kwargs. Defaults to CameraHandler.
+        """
+        self.camera_id = camera_id
+        self.handler = handler
+        self.handler_kwargs = dict(handler_kwargs or {})
+        self.factory = factory or CameraHandler
+
+        self._condition = threading.Condition()
+        self._frame = None
+        self._seq = -1
+        self._captured_at = None
+        self._published_at = None
+        self._running = False
+        self._thread = None
+        self._switch = None
+        self.last_switch = None
+
+        self.viewers = 0
+        self._frames = 0
+        self._publish_times = deque(maxlen=60)
+        self._transfer_ms = 0.0
+        self._age_ms = 0.0
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_loop, name=f"camera-{self.camera_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        if self.handler is not None:
+            self.handler.shut_down()
+            self.handler = None
+        self._drop_frame()
+
+    def _drop_frame(self):
+        # Give the latest frame back to the pool
+        with self._condition:
+            frame, self._frame = self._frame, None
+        if frame is not None:
+            frame.release()
+
+    # A source is what the capture loop reads frames from: here a camera handler
+    def _open_source(self, handler_kwargs):
+        return self.factory(**handler_kwargs)
+
+    def _read_source(self, source):
+        """
+        Return (frame, captured_at), or None if no frame was available.
+        """
+        frame = source.get_frame()
+        if frame is None:
+            return None
+        return frame, source.captured_at or time.monotonic()
+
+    def _close_source(self, source):
+        source.shut_down()
+
+    def _source_exited(self, source):
+        return source.exited()
+
+    def _capture_loop(self):
+        # Cameras opened from kwargs are released on stop so they can be reopened on start
+        owns_source = self.handler is None
+        source = self.handler
+        if owns_source:
+            try:
+                source = self._open_source(self.handler_kwargs)
+            except Exception as e:
+                logger.error("Camera failed to open", extra=fields(camera=self.camera_id, error=e))
+                self._running = False
+                return
+        try:
+            while self._running:
+                switch = self._switch
+                if switch is not None and switch.ready.is_set():
+                    source = self._finish_switch(switch, source)
+                    if source is None:
+                        self._running = False
+                    continue
+                try:
+                    item = self._read_source(source)
+                except (EOFError, OSError) as e:
+                    logger.error("Camera stopped delivering frames", extra=fields(camera=self.camera_id, error=e))
+                    self._running = False
+                    break
+                if item is None:
+                    logger.warning("No frame received from camera", extra=fields(camera=self.camera_id, rate_limit=1))
+                    time.sleep(0.1)  # Prevent a tight loop if no frames are received
+                    continue
+                self._publish(*item)
+        finally:
+            if owns_source and source is not None:
+                self._close_source(source)
+            self._cancel_switch()
+
+    def reconfigure(self, timeout=5.0, **settings):
+        """
+        Change capture settings (width, height, fps) without dropping viewers.
+        The camera is opened again with the new settings next to the current
+        one, which keeps serving until the new one delivers its first frame; then
+        viewers move over. If the camera can't be opened twice (libcamera
+        usually can't), it is stopped and reopened instead: streams stay open
+        and pause until the first new frame. If the new settings don't work the
+        old ones are restored.
+
+        Returns a CameraSwitch. Raises ReconfigureBusy while a change is running
+        and ValueError for cameras opened outside the registry.
+        """
+        if self.handler is not None:
+            raise ValueError(f"Camera {self.camera_id} was opened outside the registry and can't be reconfigured.")
+        switch = CameraSwitch({**self.handler_kwargs, **settings}, timeout)
+        with self._condition:
+            if self._switch is not None:
+                raise ReconfigureBusy(f"Camera {self.camera_id} is already being reconfigured.")
+            if not self._running:
+                # Used on the next start
+                self.handler_kwargs = switch.handler_kwargs
+                self._end_switch(switch, 'stopped')
+                return switch
+            self._switch = switch
+        logger.info("Reconfiguring camera", extra=fields(camera=self.camera_id, **settings))
+        threading.Thread(target=self._prepare_switch, args=(switch,),
+                         name=f"camera-{self.camera_id}-switch", daemon=True).start()
+        return switch
+
+    def _open_first_frame(self, handler_kwargs, timeout):
+        # Open a source and wait for its first frame, so a switch never lands on a camera that doesn't work
+        source = self._open_source(handler_kwargs)
+        try:
+            deadline = time.monotonic() + timeout
+            while self._running and time.monotonic() < deadline:
+                item = self._read_source(source)
+                if item is not None:
+                    return source, item
+                if self._source_exited(source):
+                    # Don't wait out the timeout for a camera that is already gone
+                    raise RuntimeError("Camera exited before its first frame, it may be in use.")
+                time.sleep(0.05)
+            raise TimeoutError("No frame from the camera with the new settings.")
+        except BaseException:
+            self._close_source(source)
+            raise
+
+    def _prepare_switch(self, switch):
+        # Runs next to the capture loop, which keeps serving the current settings
+        try:
+            source, first = self._open_first_frame(switch.handler_kwargs, switch.timeout)
+        except Exception as e:
+            switch.error = e
+            source, first = None, None
+        with self._condition:
+            if self._switch is switch:
+                switch.source, switch.first = source, first
+                switch.ready.set()
+                return
+        # Cancelled while opening
+        if source is not None:
+            first[0].release()
+            self._close_source(source)
+
+    def _finish_switch(self, switch, source):
+        # Runs on the capture loop. Returns the source to read from next, None if there's none.
+        previous_kwargs = self.handler_kwargs
+        error = switch.error
+        if error is None:
+            self._close_source(source)
+            self.handler_kwargs = switch.handler_kwargs
+            self._publish(*switch.first)
+            self._end_switch(switch, 'seamless')
+            return switch.source
+
+        # Most likely the sensor can't be opened twice. Release it and open it again;
+        # viewers keep their streams and get frames again once it is back.
+        logger.info("Camera couldn't be opened twice, restarting it", extra=fields(camera=self.camera_id, error=error))
+        self._close_source(source)
+        for mode, handler_kwargs in (('restart', switch.handler_kwargs), ('rollback', previous_kwargs)):
+            try:
+                source, first = self._open_first_frame(handler_kwargs, switch.timeout)
+            except Exception as e:
+                logger.error("Camera failed to reopen", extra=fields(camera=self.camera_id, mode=mode, error=e))
+                error = e
+                continue
+            self.handler_kwargs = handler_kwargs
+            self._publish(*first)
+            self._end_switch(switch, mode, None if mode == 'restart' else error)
+            return source
+        self._end_switch(switch, 'failed', error)
+        return None
+
+    def _end_switch(self, switch, mode, error=None):
+        switch.result = {
+            'ok': mode in ('seamless', 'restart', 'stopped'),
+            'mode': mode,
+            'error': str(error) if error is not None else None,
+            'switch_ms': (time.monotonic() - switch.requested_at) * 1000,
+            'settings': self.settings(),
+        }
+        self.last_switch = switch.result
+        with self._condition:
+            if self._switch is switch:
+                self._switch = None
+        logger.info("Camera reconfigured", extra=fields(camera=self.camera_id, **{
+            key: value for key, value in switch.result.items() if key != 'settings'}))
+        switch.done.set()
+
+    def _cancel_switch(self):
+        # The capture loop is ending; a camera still being opened is closed by _prepare_switch
+        with self._condition:
+            switch, self._switch = self._switch, None
+        if switch is None:
+            return
+        if switch.source is not None:
+            switch.first[0].release()
+            self._close_source(switch.source)
+        self._end_switch(switch, 'cancelled')
+
+    def settings(self):
+        if self.handler is not None:
+            return {key: getattr(self.handler, key, None) for key in SETTING_LIMITS}
+        return {key: self.handler_kwargs.get(key) for key in SETTING_LIMITS}
+
+    def _publish(self, frame, captured_at):
+        # Takes over the caller's reference to the frame
+        now = time.monotonic()
+        with self._condition:
+            previous = self._frame
+            self._frame = frame
+            self._seq += 1
+            self._captured_at = captured_at
+            self._published_at = now
+            self._frames += 1
+            self._publish_times.append(now)
+            self._transfer_ms = 0.9 * self._transfer_ms + 0.1 * (now - captured_at) * 1000
+            self._condition.notify_all()
+        if previous is not None:
+            previous.release()
+
+    def wait_frame(self, last_seq, timeout=1.0):
+        """
+        Wait for a frame newer than `last_seq` and return (seq, frame, times),
+        with times the frame's (captured_at, published_at) in time.monotonic().
+        The frame is a pooled buffer with a reference taken for the caller, who
+        must release it. Returns (last_seq, None, None) on timeout or when the
+        camera is stopped.
+        """
+        with self._condition:
+            if self._seq <= last_seq and self._running:
+                self._condition.wait(timeout)
+            if self._seq <= last_seq or self._frame is None:
+                return last_seq, None, None
+            age_ms = (time.monotonic() - self._captured_at) * 1000
+            self._age_ms = 0.9 * self._age_ms + 0.1 * age_ms
+            return self._seq, self._frame.acquire(), (self._captured_at, self._published_at)
+
+    def viewer_joined(self):
+        with self._condition:
+            self.viewers += 1
+
+    def viewer_left(self):
+        with self._condition:
+            self.viewers -= 1
+
+    def fps(self):
+        """
+        Frames published per second over the last 60 frames, 0 when stopped.
+        """
+        with self._condition:
+            times = self._publish_times
+            if not self._running or len(times) < 2 or times[-1] <= times[0]:
+                return 0.0
+            return (len(times) - 1) / (times[-1] - times[0])
+
+    def stats(self):
+        fps = self.fps()
+        with self._condition:
+            return {
+                'running': self._running,
+                'process': False,
+                'viewers': self.viewers,
+                'frames': self._frames,
+                'fps': fps,
+                # capture to hand-off in this process (pipe transfer for process workers)
+                'transfer_ms': self._transfer_ms,
+                # how old frames are when viewers pick them up
+                'frame_age_ms': self._age_ms,
+                'settings': self.settings(),
+                'reconfiguring': self._switch is not None,
+                'last_switch': self.last_switch,
+            }
+
+
+def _capture_process(conn, stop, factory, handler_kwargs):
+    # Runs in the child process: read, make sure it's JPEG, send the bytes to the parent
+    handler = factory(**handler_kwargs)
+    try:
+        while not stop.is_set():
+            frame = handler.get_frame()
+            if frame is None:
+                if handler.exited():
+                    break  # The parent sees this process exit
+                time.sleep(0.1)
+                continue
+            captured_at = handler.captured_at or time.monotonic()
+            if isinstance(frame, PooledImage):
+                ok, jpeg_frame = cv2.imencode('.jpg', frame.data)
+                frame.release()
+                if not ok:
+                    continue
+                conn.send((captured_at, len(jpeg_frame)))
+                conn.send_bytes(jpeg_frame)
+            else:
+                conn.send((captured_at, len(frame)))
+                conn.send_bytes(frame.view())
+                frame.release()
+    except (BrokenPipeError, EOFError):
+        pass
+    finally:
+        handler.shut_down()
+
+
+class _CaptureProcess:
+    def __init__(self, context, camera_id, factory, handler_kwargs):
+        # A camera opened in a child process, the source of a ProcessCameraWorker
+        self.conn, child_conn = context.Pipe(duplex=False)
+        self.stop_event = context.Event()
+        self.process = context.Process(
+            target=_capture_process,
+            args=(child_conn, self.stop_event, factory, handler_kwargs),
+            name=f"camera-{camera_id}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def close(self):
+        self.stop_event.set()
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class ProcessCameraWorker(CameraWorker):
+    def __init__(self, camera_id, handler_kwargs=None, factory=None):
+        """
+        CameraWorker that reads and parses the camera in a separate process, so
+        several cameras can use several cores. Frames reach this process as JPEG
+        bytes, received straight into pooled buffers. time.monotonic is system
+        wide on Linux, so capture times taken in the child are comparable here.
+        """
+        super().__init__(camera_id, handler_kwargs=handler_kwargs, factory=factory)
+        self._context = multiprocessing.get_context('spawn')
+
+    def close(self):
+        self.stop()
+        self._drop_frame()
+
+    def _open_source(self, handler_kwargs):
+        return _CaptureProcess(self._context, self.camera_id, self.factory, handler_kwargs)
+
+    def _read_source(self, source):
+        # Receives frames from the child process
+        if not source.conn.poll(0.5):
+            if not source.process.is_alive():
+                raise EOFError("Camera process exited.")
+            return None
+        captured_at, size = source.conn.recv()
+        frame = frame_pool.get_buffer(size)
+        frame.length = source.conn.recv_bytes_into(frame.data)
+        return frame, captured_at
+
+    def _close_source(self, source):
+        source.close()
+
+    def _source_exited(self, source):
+        return not source.process.is_alive()
+
+    def stats(self):
+        stats = super().stats()
+        stats['process'] = True
+        return stats
+
+
+class CameraRegistry:
+    def __init__(self):
+        """
+        The cameras available to the web server, each with its own capture worker.
+        The first camera added is the default one served at /video_feed.
+        """
+        self.workers = {}
+        self.default_id = None
+
+    def add(self, camera_id, process=False, factory=None, **handler_kwargs):
+        """
+        Register a camera opened from CameraHandler arguments. With process=True
+        it is read in its own process. `factory` replaces CameraHandler, e.g.
+        with stubs.StubCamera.
+        """
+        if camera_id in self.workers:
+            raise ValueError(f"Camera {camera_id} is already registered.")
+        if process:
+            worker = ProcessCameraWorker(camera_id, handler_kwargs=handler_kwargs, factory=factory)
+        else:
+            worker = CameraWorker(camera_id, handler_kwargs=handler_kwargs, factory=factory)
+        return self._register(worker)
+
+    def add_handler(self, camera_id, handler):
+        """
+        Register an already opened camera. It is read on a thread of this process.
+        """
+        if camera_id in self.workers:
+            raise ValueError(f"Camera {camera_id} is already registered.")
+        return self._register(CameraWorker(camera_id, handler=handler))
+
+    def _register(self, worker):
+        self.workers[worker.camera_id] = worker
+        if self.default_id is None:
+            self.default_id = worker.camera_id
+        return worker
+
+    def get(self, camera_id=None):
+        """
+        The worker for `camera_id`, or the default camera. Raises KeyError for unknown cameras.
+        """
+        return self.workers[camera_id or self.default_id]
+
+    def start(self, camera_id=None):
+        """
+        Start one camera, or all of them when no id is given.
+        """
+        for worker in self._select(camera_id):
+            worker.start()
+
+    def stop(self, camera_id=None):
+        for worker in self._select(camera_id):
+            worker.stop()
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.close()
+
+    def _select(self, camera_id):
+        if camera_id is None:
+            return list(self.workers.values())
+        return [self.workers[camera_id]]
+
+    def running(self):
+        return {camera_id: worker.running for camera_id, worker in self.workers.items()}
+
+    def settings(self):
+        return {camera_id: worker.settings() for camera_id, worker in self.workers.items()}
+
+    def stats(self):
+        return {camera_id: worker.stats() for camera_id, worker in self.workers.items()}
@@ -0,0 +1,209 @@
+"""
+
+Example:
+from camera_stream import CameraStream
+stream = CameraStream(cameras.get('front'), tracker)
+stream.viewer_joined()
+seq, frame = stream.wait_frame(last_seq=-1)
+send(frame.item['jpeg'])
+frame.release()
+stream.viewer_left()
+
+"""
+
+import time
+import threading
+
+import cv2
+import numpy as np
+
+from camera import CameraHandler
+from pipeline import FramePipeline
+from bufferpool import frame_pool, PooledImage
+from log import get_logger, fields
+
+logger = get_logger(__name__)
+
+
+class SharedFrame:
+    def __init__(self, item, release):
+        """
+        An encoded frame shared by every viewer of a stream. `item` holds the
+        JPEG under 'jpeg' plus the frame's seq and timing. `release` is called
+        with the item when the last reference is given back.
+        """
+        self.item = item
+        self._release = release
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            if self._refs < 0:
+                raise RuntimeError("Shared frame released more times than acquired.")
+        self._release(self.item)
+
+
+class CameraStream:
+    def __init__(self, worker, tracker, workers=None):
+        """
+        Decodes, annotates and encodes a camera's frames once for all of its
+        viewers. While anyone is watching, a feeder thread takes each captured
+        frame, runs it through one FramePipeline and keeps the latest encoded
+        frame, which viewers pick up like they pick up captured frames from the
+        camera worker.
+
+        Parameters:
+        worker (CameraWorker): Camera to stream.
+        tracker (BoxTracker): Boxes drawn on the frames. No live tracks means frames are passed through untouched.
+        workers (int): Pipeline worker threads. Defaults to the number of cores.
+        """
+        self.worker = worker
+        self.tracker = tracker
+        self.workers = workers
+        self.pipeline = None
+        self.viewers = 0
+
+        self._condition = threading.Condition()
+        self._frame = None  # SharedFrame
+        self._seq = -1
+        self._thread = None
+
+    def viewer_joined(self):
+        with self._condition:
+            self.viewers += 1
+            self._start_feeder()
+        self.worker.viewer_joined()
+
+    def viewer_left(self):
+        self.worker.viewer_left()
+        with self._condition:
+            self.viewers -= 1
+
+    def _start_feeder(self):
+        # Called with the condition held
+        if self._thread is None and self.viewers and self.worker.running:
+            self._thread = threading.Thread(target=self._feed, name=f"stream-{self.worker.camera_id}", daemon=True)
+            self._thread.start()
+
+    def _feed(self):
+        # Runs while the stream has viewers; a viewer waiting after it ends starts a new one
+        pipeline = FramePipeline([
+            ('decode', self._decode_stage),
+            ('annotate', self._annotate_stage),
+            ('encode', self._encode_stage),
+        ], workers=self.workers, discard=self._release_item)
+        self.pipeline = pipeline
+        try:
+            seq = -1
+            while True:
+                with self._condition:
+                    if not self.viewers or not self.worker.running:
+                        break
+                seq, frame, times = self.worker.wait_frame(seq, timeout=0.5)
+                if frame is not None:
+                    picked_at = time.monotonic()
+                    # Boxes are predicted per frame so a change never lands half way through one
+                    pipeline.submit({
+                        'seq': seq, 'frame': frame, 'boxes': self.tracker.predict(picked_at),
+                        'captured_at': times[0], 'published_at': times[1], 'picked_at': picked_at,
+                    })
+                # Wait a little for this frame so it goes out without waiting for the next capture
+                for item in pipeline.pop_ready(timeout=0.02):
+                    self._publish(item)
+        except Exception as e:
+            logger.error("Stream feeder failed", extra=fields(camera=self.worker.camera_id, error=e, rate_limit=1))
+        finally:
+            pipeline.close()
+            self._drop_frame()
+            with self._condition:
+                self._thread = None
+                self._condition.notify_all()
+
+    def _publish(self, item):
+        frame = SharedFrame(item, self._release_item)
+        with self._condition:
+            previous = self._frame
+            self._frame = frame
+            self._seq = item['seq']
+            self._condition.notify_all()
+        if previous is not None:
+            previous.release()
+
+    def _drop_frame(self):
+        with self._condition:
+            frame, self._frame = self._frame, None
+        if frame is not None:
+            frame.release()
+
+    def wait_frame(self, last_seq, timeout=1.0):
+        """
+        Wait for an encoded frame newer than `last_seq` and return (seq, frame),
+        with a reference to the SharedFrame taken for the caller, who must
+        release it. Returns (last_seq, None) on timeout or when the stream stops.
+        """
+        with self._condition:
+            self._start_feeder()
+            if self._seq <= last_seq:
+                self._condition.wait(timeout)
+            if self._seq <= last_seq or self._frame is None:
+                return last_seq, None
+            return self._seq, self._frame.acquire()
+
+    def stats(self):
+        pipeline = self.pipeline
+        stats = pipeline.stats() if pipeline is not None else {}
+        stats['camera'] = self.worker.camera_id
+        stats['viewers'] = self.viewers
+        return stats
+
+    def _decode_stage(self, item):
+        frame = item['frame']
+        # Without overlays a JPEG from the camera can be sent as is
+        if not item['boxes']:
+            return item
+        if isinstance(frame, PooledImage):
+            # Overlays are drawn on a copy, the camera worker keeps sharing the captured image
+            image = frame_pool.get_image(frame.data.shape, frame.data.dtype)
+            np.copyto(image.data, frame.data)
+            item['pooled_image'] = image
+            item['image'] = image.data
+        else:
+            item['image'] = CameraHandler.decode_frame(frame)
+            if item['image'] is None:
+                return None
+        return item
+
+    def _annotate_stage(self, item):
+        if item['boxes']:
+            CameraHandler.draw_bounding_boxes(item['image'], item['boxes'])
+        return item
+
+    def _encode_stage(self, item):
+        image = item.get('image')
+        if image is None and isinstance(item['frame'], PooledImage):
+            image = item['frame'].data
+        if image is not None:
+            # Re-encode the modified image back to JPEG format; the array is sent as is
+            ok, item['jpeg'] = cv2.imencode('.jpg', image)
+            if not ok:
+                return None
+        else:
+            item['jpeg'] = item['frame'].view()
+        item['encoded_at'] = time.monotonic()
+        return item
+
+    @staticmethod
+    def _release_item(item):
+        # Hand the item's pooled buffers back once every viewer is done with it, or it is dropped
+        item['frame'].release()
+        if 'pooled_image' in item:
+            item['pooled_image'].release()
@@ -0,0 +1,401 @@
+"""
+
+Example:
+from functools import partial
+from edge_impulse_linux.image import ImageImpulseRunner
+from detector_pool import DetectorPool
+pool = DetectorPool(partial(ImageImpulseRunner, model_path), image_shape=(540, 960, 3), workers=3)
+pool.start()
+pool.submit(frame_number, image, captured_at=time.monotonic())   # False if every worker is busy
+for frame_number, bounding_boxes, captured_at in pool.poll():     # in frame order
+    tracker.update(bounding_boxes, captured_at)
+pool.close()
+
+Try it with a stand-in model: python detector_pool.py
+
+"""
+
+import time
+import threading
+import multiprocessing
+from collections import deque
+
+import cv2
+import numpy as np
+
+from log import get_logger, fields, setup_logging
+
+logger = get_logger(__name__)
+
+
+def _detector_process(worker_id, runner_factory, on_result, tasks, results, slot, image_shape):
+    # Runs in the worker process: one model runner, one frame at a time from the shared slot
+    runner = runner_factory()
+    try:
+        runner.init()
+    except Exception as e:
+        results.send(('init_error', worker_id, str(e)))
+        return
+    image = np.frombuffer(slot, dtype=np.uint8).reshape(image_shape)
+    results.send(('ready', worker_id, None))
+    try:
+        while True:
+            try:
+                frame_number = tasks.recv()
+            except EOFError:
+                break
+            if frame_number is None:  # Sentinel value to end the process
+                break
+            started_at = time.monotonic()
+            bounding_boxes, error = None, None
+            try:
+                frame_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                features, cropped = runner.get_features_from_image(frame_rgb)
+                result = runner.classify(features)
+                bounding_boxes = result["result"].get("bounding_boxes", [])
+                if on_result is not None:
+                    on_result(image, result)
+            except Exception as e:
+                error = str(e)
+            results.send(('done', worker_id, (frame_number, bounding_boxes, error, started_at, time.monotonic())))
+    finally:
+        stop = getattr(runner, 'stop', None)
+        if stop is not None:
+            stop()
+
+
+class _Worker:
+    def __init__(self, worker_id, slot, image_shape):
+        self.worker_id = worker_id
+        self.slot = slot
+        self.image = np.frombuffer(slot, dtype=np.uint8).reshape(image_shape)
+        self.process = None
+        self.tasks = None
+        self.results = None  # this process's own result pipe, dropped with it on restart
+        self.ready = False
+        self.exit_seen = False
+        self.started_at = 0.0
+        self.task = None  # (frame_number, submitted_at) while busy
+
+        self.frames = 0
+        self.errors = 0
+        self.restarts = 0
+        self.init_failures = 0  # in a row; reset once the runner starts
+        self.failed = False     # gave up restarting
+        self.finished_at = deque(maxlen=30)
+        self.inference_ms = 0.0
+        self.queue_wait_ms = 0.0
+
+
+class DetectorPool:
+    def __init__(self, runner_factory, image_shape, workers=2, on_result=None, max_age=1.0,
+                 task_timeout=5.0, restart_delay=1.0, max_restart_delay=60.0, max_init_failures=5, context=None):
+        """
+        Runs object detection on several model runner processes. A frame is
+        copied into the shared image slot of a worker that is free (round robin
+        among the free ones) and dropped if none is, so frames never queue up
+        behind a slow model. Results are handed back in frame order; results
+        that arrive after a newer frame was already handed back, or that are
+        older than max_age, are discarded. Workers that die or hang are restarted.
+        A runner that fails to start is retried with a growing delay and given
+        up on after max_init_failures tries in a row.
+
+        Parameters:
+        runner_factory (callable): Creates a runner with init(), get_features_from_image(image)
+                                   and classify(features), like ImageImpulseRunner. Called in the worker.
+        image_shape (tuple): (height, width, channels) of the BGR frames submitted.
+        workers (int): Number of runner processes.
+        on_result (callable): Called in the worker with (image, result) after each
+                              classification. The image is the shared slot; copy it to keep it.
+        max_age (float): Seconds after capture a result is still worth using.
+        task_timeout (float): Seconds a frame may take before its worker is restarted.
+        restart_delay (float): Minimum seconds between starts of the same worker.
+        max_restart_delay (float): Cap on the delay, which doubles with each failed start.
+        max_init_failures (int): Failed starts in a row before a worker is given up on.
+        context: multiprocessing context. Defaults to the platform default.
+        """
+        self.runner_factory = runner_factory
+        self.image_shape = tuple(image_shape)
+        self.on_result = on_result
+        self.max_age = max_age
+        self.task_timeout = task_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.max_init_failures = max_init_failures
+        self._context = context or multiprocessing.get_context()
+        size = int(np.prod(self.image_shape))
+        self._workers = [_Worker(i, self._context.RawArray('B', size), self.image_shape) for i in range(workers)]
+        self._next_worker = 0
+
+        self._lock = threading.Lock()
+        self._order = deque()  # frame numbers in flight, in submit order
+        self._captured_at = {}  # frame number -> capture time
+        self._done = {}         # frame number -> bounding boxes, None if the frame was lost
+        self._running = False
+
+        self.submitted = 0
+        self.no_free_worker = 0
+        self.released = 0
+        self.stale = 0
+        self.lost = 0
+
+    def start(self):
+        with self._lock:
+            self._running = True
+            for worker in self._workers:
+                worker.failed = False
+                worker.init_failures = 0
+                self._start_worker(worker)
+
+    def _start_worker(self, worker):
+        task_reader, task_writer = self._context.Pipe(duplex=False)
+        # Each process gets its own result pipe: killing a hung one mid-write can't
+        # break a pipe or lock that the other workers use
+        result_reader, result_writer = self._context.Pipe(duplex=False)
+        worker.process = self._context.Process(
+            target=_detector_process,
+            args=(worker.worker_id, self.runner_factory, self.on_result, task_reader, result_writer,
+                  worker.slot, self.image_shape),
+            name=f"detector-{worker.worker_id}",
+            daemon=True,
+        )
+        worker.process.start()
+        task_reader.close()
+        result_writer.close()
+        worker.tasks = task_writer
+        worker.results = result_reader
+        worker.ready = False
+        worker.exit_seen = False
+        worker.task = None
+        worker.started_at = time.monotonic()
+
+    def _stop_worker(self, worker, timeout=2):
+        if worker.process is None:
+            return
+        try:
+            worker.tasks.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        worker.process.join(timeout=timeout)
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(timeout=1)
+        worker.tasks.close()
+        worker.results.close()
+        worker.process = None
+        worker.ready = False
+
+    def _lose_task(self, worker):
+        # The frame a dead or hung worker was holding won't get a result
+        if worker.task is not None:
+            frame_number = worker.task[0]
+            if frame_number in self._captured_at:
+                self._done[frame_number] = None
+                self.lost += 1
+            worker.task = None
+
+    def _check_workers(self, now):
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            hung = worker.task is not None and now - worker.task[1] > self.task_timeout
+            if worker.process.is_alive() and not hung:
+                continue
+            if not hung and not worker.ready and not worker.exit_seen:
+                # Exited before its runner was ready: model missing, device busy...
+                worker.init_failures += 1
+            worker.exit_seen = True
+            worker.ready = False
+            delay = min(self.restart_delay * 2 ** max(worker.init_failures - 1, 0), self.max_restart_delay)
+            if now - worker.started_at < delay:
+                continue
+            self._lose_task(worker)
+            if hung:
+                worker.process.terminate()
+            worker.process.join(timeout=1)
+            worker.tasks.close()
+            # Anything the old process left in its pipe is dropped with it
+            worker.results.close()
+            if worker.init_failures >= self.max_init_failures:
+                logger.error("Detector worker failed to start, giving up", extra=fields(
+                    worker=worker.worker_id, attempts=worker.init_failures))
+                worker.process = None
+                worker.failed = True
+                continue
+            logger.warning("Detector worker restarted", extra=fields(
+                worker=worker.worker_id, reason='timeout' if hung else 'exited',
+                exitcode=worker.process.exitcode, init_failures=worker.init_failures, rate_limit=1))
+            worker.restarts += 1
+            self._start_worker(worker)
+
+    def submit(self, frame_number, image, captured_at=None):
+        """
+        Send a BGR frame to a free worker. Frame numbers must increase. Returns
+        False, without copying the frame, when every worker is busy.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self._running:
+                return False
+            self._check_workers(now)
+            count = len(self._workers)
+            for offset in range(count):
+                worker = self._workers[(self._next_worker + offset) % count]
+                if worker.ready and worker.task is None:
+                    break
+            else:
+                self.no_free_worker += 1
+                return False
+            self._next_worker = (worker.worker_id + 1) % count
+
+            # The worker only reads the slot after getting the frame number
+            np.copyto(worker.image, image)
+            try:
+                worker.tasks.send(frame_number)
+            except (BrokenPipeError, OSError):
+                return False
+            worker.task = (frame_number, now)
+            self._order.append(frame_number)
+            self._captured_at[frame_number] = captured_at if captured_at is not None else now
+            self.submitted += 1
+            return True
+
+    def poll(self):
+        """
+        Return the results that can be handed back, as (frame_number,
+        bounding_boxes, captured_at) in frame order. Never blocks.
+        """
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            # Read under the lock so _check_workers can't close a pipe while it is read
+            for worker in self._workers:
+                if worker.process is None:
+                    continue
+                try:
+                    while worker.results.poll():
+                        kind, _, payload = worker.results.recv()
+                        self._handle_message(worker, kind, payload)
+                except (EOFError, OSError):
+                    pass  # Exited; _check_workers restarts it
+            self._check_workers(now)
+            while self._order:
+                frame_number = self._order[0]
+                captured_at = self._captured_at[frame_number]
+                if frame_number not in self._done:
+                    if now - captured_at <= self.max_age:
+                        break
+                    # Too late to be useful; a result arriving later is discarded
+                    self._done[frame_number] = None
+                    self.stale += 1
+                self._order.popleft()
+                del self._captured_at[frame_number]
+                bounding_boxes = self._done.pop(frame_number)
+                if bounding_boxes is None:
+                    continue
+                if now - captured_at > self.max_age:
+                    self.stale += 1
+                    continue
+                self.released += 1
+                ready.append((frame_number, bounding_boxes, captured_at))
+        return ready
+
+    def _handle_message(self, worker, kind, payload):
+        # Called with the lock held
+        worker_id = worker.worker_id
+        if kind == 'ready':
+            worker.ready = True
+            worker.init_failures = 0
+            return
+        if kind == 'init_error':
+            logger.error("Detector worker failed to start", extra=fields(worker=worker_id, error=payload, rate_limit=1))
+            return
+
+        frame_number, bounding_boxes, error, started_at, finished_at = payload
+        if worker.task is not None and worker.task[0] == frame_number:
+            worker.queue_wait_ms = 0.9 * worker.queue_wait_ms + 0.1 * (started_at - worker.task[1]) * 1000
+            worker.task = None
+        worker.frames += 1
+        worker.finished_at.append(finished_at)
+        worker.inference_ms = 0.9 * worker.inference_ms + 0.1 * (finished_at - started_at) * 1000
+        if error is not None:
+            worker.errors += 1
+            logger.warning("Detection failed", extra=fields(worker=worker_id, frame=frame_number, error=error, rate_limit=1))
+
+        if frame_number not in self._captured_at:
+            # Given up on already, counted as stale or lost then
+            return
+        self._done[frame_number] = bounding_boxes if error is None else None
+
+    def stats(self):
+        """
+        Per-worker throughput, inference time and queue wait, plus pool counters.
+        """
+        with self._lock:
+            workers = []
+            for worker in self._workers:
+                times = worker.finished_at
+                fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 0.0
+                workers.append({
+                    'worker': worker.worker_id,
+                    'alive': worker.process is not None and worker.process.is_alive(),
+                    'ready': worker.ready,
+                    'busy': worker.task is not None,
+                    'frames': worker.frames,
+                    'errors': worker.errors,
+                    'restarts': worker.restarts,
+                    'init_failures': worker.init_failures,
+                    'failed': worker.failed,
+                    'fps': fps,
+                    'inference_ms': worker.inference_ms,
+                    # submit to the worker starting on the frame
+                    'queue_wait_ms': worker.queue_wait_ms,
+                })
+            return {
+                'submitted': self.submitted,
+                'no_free_worker': self.no_free_worker,
+                'released': self.released,
+                'stale': self.stale,
+                'lost': self.lost,
+                'in_flight': len(self._order),
+                # every worker gave up starting; detection is off
+                'failed': all(worker.failed for worker in self._workers),
+                'workers': workers,
+            }
+
+    def close(self):
+        with self._lock:
+            self._running = False
+            for worker in self._workers:
+                self._stop_worker(worker)
+            self._order.clear()
+            self._captured_at.clear()
+            self._done.clear()
+
+
+# Test: python detector_pool.py
+if __name__ == "__main__":
+    from functools import partial
+    from stubs import StubRunner
+
+    setup_logging()
+    shape = (270, 480, 3)
+    pool = DetectorPool(partial(StubRunner, delay=0.1, crash_every=25), shape, workers=3)
+    pool.start()
+    try:
+        image = np.zeros(shape, dtype=np.uint8)
+        released = []
+        start = time.monotonic()
+        frame_number = 0
+        while time.monotonic() - start < 5:
+            pool.submit(frame_number, image)
+            released.extend(number for number, _, _ in pool.poll())
+            frame_number += 1
+            time.sleep(1 / 30)
+
+        assert released == sorted(released), "Results were released out of order"
+        print(f"Released {len(released)} results in order from {frame_number} frames")
+        for key, value in pool.stats().items():
+            print(key, value)
+    finally:
+        pool.close()
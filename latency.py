@@ -0,0 +1,181 @@
+"""
+
+Example:
+from latency import FrameLatency
+latency = FrameLatency()
+latency.frame_sent(stream_id, seq, captured_at, published_at, picked_at, encoded_at, time.monotonic())
+latency.frame_displayed(stream_id, seq, display_ms=12.5, rtt_ms=8.0)   # reported by the page
+latency.stats()['end_to_end']['p50']
+
+"""
+
+import math
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LatencyHistogram:
+    def __init__(self, min_ms=0.1, max_ms=60000, buckets_per_decade=20):
+        """
+        Fixed size histogram with log spaced buckets, so percentiles keep about
+        12% resolution from sub-millisecond to a minute without storing samples.
+
+        Parameters:
+        min_ms (float), max_ms (float): Range covered. Values outside it land in the first or last bucket.
+        buckets_per_decade (int): Buckets per factor of 10.
+        """
+        decades = np.log10(max_ms / min_ms)
+        self.edges = min_ms * 10 ** (np.arange(int(np.ceil(decades * buckets_per_decade)) + 1) / buckets_per_decade)
+        self.counts = np.zeros(len(self.edges), dtype=np.int64)  # counts[i]: values <= edges[i]
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, value_ms):
+        value_ms = float(value_ms)
+        if not math.isfinite(value_ms):
+            return
+        value_ms = max(value_ms, 0.0)
+        index = min(int(np.searchsorted(self.edges, value_ms)), len(self.edges) - 1)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value_ms
+            self.max = max(self.max, value_ms)
+
+    def percentile(self, p):
+        """
+        Upper edge of the bucket holding the p-th percentile (0-100), or None when empty.
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            index = int(np.searchsorted(np.cumsum(self.counts), self.count * p / 100.0))
+            return float(min(self.edges[min(index, len(self.edges) - 1)], self.max))
+
+    def summary(self, buckets=False):
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max if self.count else None,
+        }
+        if buckets:
+            with self._lock:
+                summary['buckets'] = [[round(float(edge), 3), int(count)]
+                                      for edge, count in zip(self.edges, self.counts) if count]
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self.counts[:] = 0
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+
+class FrameLatency:
+    # Hops in the order a frame goes through them
+    HOPS = (
+        'capture_to_publish',     # libcamera pipe / capture process -> latest frame in this process
+        'publish_to_pickup',      # waiting for the stream to take the frame
+        'pickup_to_encoded',      # decode, overlays and encode in the frame pipeline
+        'encoded_to_sent',        # waiting for earlier frames, then handed to the HTTP server
+        'sent_to_received',       # network and the page reading the part (from the page's reports)
+        'received_to_displayed',  # browser decode and paint (from the page's reports)
+    )
+
+    def __init__(self, max_pending=2000):
+        """
+        Latency of every frame sent, per hop and end to end (capture to display
+        in the browser). Server side hops are recorded as frames are sent; the
+        browser hops and the end to end time come from the page reporting when
+        it displayed a frame.
+
+        Parameters:
+        max_pending (int): Sent frames remembered while waiting for a display report.
+        """
+        self.max_pending = max_pending
+        self.histograms = {name: LatencyHistogram() for name in self.HOPS + ('end_to_end',)}
+        self._sent = OrderedDict()  # (stream_id, seq) -> (captured_at, sent_at)
+        self._lock = threading.Lock()
+        self.reports = 0
+        self.unmatched_reports = 0
+
+    def frame_sent(self, stream_id, seq, captured_at, published_at, picked_at, encoded_at, sent_at):
+        """
+        Record the server side hops of a frame. All times are time.monotonic().
+        """
+        self.histograms['capture_to_publish'].add((published_at - captured_at) * 1000)
+        self.histograms['publish_to_pickup'].add((picked_at - published_at) * 1000)
+        self.histograms['pickup_to_encoded'].add((encoded_at - picked_at) * 1000)
+        self.histograms['encoded_to_sent'].add((sent_at - encoded_at) * 1000)
+        with self._lock:
+            self._sent[(stream_id, seq)] = (captured_at, sent_at)
+            while len(self._sent) > self.max_pending:
+                self._sent.popitem(last=False)
+
+    def frame_displayed(self, stream_id, seq, display_ms, rtt_ms=None):
+        """
+        Record the page's report that a frame was displayed. The report reached
+        the server about half a Socket.IO round trip after the frame was shown,
+        which is taken off the arrival time. Returns False for unknown frames.
+
+        Parameters:
+        stream_id (int), seq (int): From the X-Stream-Id and X-Frame-Seq part headers.
+        display_ms (float): Time on the page from receiving the part to painting it.
+        rtt_ms (float): The page's Socket.IO round trip estimate, if it has one.
+        """
+        arrived_at = time.monotonic()
+        with self._lock:
+            times = self._sent.pop((stream_id, seq), None)
+            self.reports += 1
+            if times is None:
+                self.unmatched_reports += 1
+                return False
+        captured_at, sent_at = times
+        displayed_at = arrived_at - (rtt_ms or 0) / 2000.0
+        display_ms = max(display_ms, 0.0)
+        self.histograms['sent_to_received'].add(max((displayed_at - sent_at) * 1000 - display_ms, 0.0))
+        self.histograms['received_to_displayed'].add(display_ms)
+        self.histograms['end_to_end'].add((displayed_at - captured_at) * 1000)
+        return True
+
+    def stats(self, buckets=False):
+        stats = {name: histogram.summary(buckets) for name, histogram in self.histograms.items()}
+        stats['reports'] = self.reports
+        stats['unmatched_reports'] = self.unmatched_reports
+        return stats
+
+    def clear(self):
+        for histogram in self.histograms.values():
+            histogram.clear()
+        with self._lock:
+            self._sent.clear()
+            self.reports = 0
+            self.unmatched_reports = 0
+
+
+# Test: python latency.py
+if __name__ == "__main__":
+    import random
+
+    histogram = LatencyHistogram()
+    values = [random.lognormvariate(3, 0.5) for _ in range(10000)]
+    for value in values:
+        histogram.add(value)
+    values.sort()
+    print(f"p50 {histogram.percentile(50):.1f} ms (exact {values[5000]:.1f}), "
+          f"p99 {histogram.percentile(99):.1f} ms (exact {values[9900]:.1f})")
+
+    latency = FrameLatency()
+    now = time.monotonic()
+    latency.frame_sent(0, 1, now - 0.060, now - 0.050, now - 0.040, now - 0.020, now - 0.015)
+    latency.frame_displayed(0, 1, display_ms=5.0, rtt_ms=10.0)
+    print({name: summary['p50'] for name, summary in latency.stats().items() if isinstance(summary, dict)})
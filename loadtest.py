@@ -0,0 +1,319 @@
+"""
+
+Load test for RoverWebServer with a stub camera and fake GPIO.
+
+Starts the server in a child process, then opens video viewers (some of them
+deliberately slow) and Socket.IO drivers sending joystick_move, and writes a
+JSON report that can be compared with an earlier run.
+
+Example:
+python loadtest.py --viewers 4 --slow-viewers 2 --drivers 3 --duration 30 --report report.json
+python loadtest.py --viewers 8 --drivers 3 --compare report.json
+
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+
+import requests
+import socketio
+
+
+def serve(args):
+    # Runs in the child process
+    from log import setup_logging
+    from stubs import install_fake_gpio, StubCamera
+    setup_logging()
+    install_fake_gpio()
+    from motor import MotorDriver
+    from camera_registry import CameraRegistry
+    from webserver import RoverWebServer
+
+    motor_driver = MotorDriver(in1_pin=24, in2_pin=23, ena_pin=12, in3_pin=22, in4_pin=27, enb_pin=18,
+                               pwm_backend='mock')
+    # Opened from settings like the real camera, so /cameras/default/config can change them
+    cameras = CameraRegistry()
+    cameras.add('default', factory=StubCamera, width=args.width, height=args.height, fps=args.fps)
+    web_server = RoverWebServer(motor_driver, cameras, 25)
+    web_server.state.update(stream_on=True)
+    web_server.start(host='127.0.0.1', port=args.port)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[index]
+
+
+class Viewer(threading.Thread):
+    def __init__(self, url, stop, slow=False):
+        """
+        Reads /video_feed like a browser <img> would. A slow viewer reads small
+        chunks with pauses in between, like a client on a poor link.
+        """
+        super().__init__(daemon=True)
+        self.url = url
+        self.stop = stop
+        self.slow = slow
+        self.frames = 0
+        self.bytes = 0
+        self.error = None
+        self.started_at = None
+        self.ended_at = None
+
+    def run(self):
+        self.started_at = time.monotonic()
+        chunk_size = 4096 if self.slow else 65536
+        marker = b'--frame\r\n'
+        tail = b''
+        try:
+            with requests.get(self.url, stream=True, timeout=10) as response:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    self.bytes += len(chunk)
+                    # Count part boundaries, including ones split across chunks
+                    data = tail + chunk
+                    self.frames += data.count(marker)
+                    # One byte short of a marker, so a marker at the end isn't counted twice
+                    tail = data[-(len(marker) - 1):]
+                    if self.stop.is_set():
+                        break
+                    if self.slow:
+                        time.sleep(0.05)
+        except Exception as e:
+            self.error = str(e)
+        self.ended_at = time.monotonic()
+
+    def result(self):
+        elapsed = max((self.ended_at or time.monotonic()) - self.started_at, 1e-9)
+        return {
+            'slow': self.slow,
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'fps': self.frames / elapsed,
+            'kbps': self.bytes * 8 / 1000 / elapsed,
+            'error': self.error,
+        }
+
+
+class Driver(threading.Thread):
+    def __init__(self, url, stop, rate_hz):
+        """
+        Sends joystick_move at a fixed rate with a sweeping position. The server
+        acknowledges each event once the handler (and so the PWM update) has run,
+        so the ack round trip is an upper bound on joystick-to-PWM latency.
+        """
+        super().__init__(daemon=True)
+        self.url = url
+        self.stop = stop
+        self.rate_hz = rate_hz
+        self.sent = 0
+        self.latencies = []
+        self.error = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        client = socketio.Client(reconnection=False)
+        try:
+            client.connect(self.url, transports=['websocket', 'polling'])
+        except Exception as e:
+            self.error = str(e)
+            return
+
+        interval = 1.0 / self.rate_hz
+        next_send = time.monotonic()
+        step = 0
+        while not self.stop.is_set():
+            # Sweep through drive, turn, spin and stop positions
+            forward = [60, 60, 0, -50, 0][step % 5]
+            rightward = [0, 40, 80, -30, 0][step % 5]
+            sent_at = time.perf_counter()
+            client.emit('joystick_move', {'coordinates': [forward, rightward]},
+                        callback=lambda *args, sent_at=sent_at: self._ack(sent_at))
+            self.sent += 1
+            step += 1
+            next_send += interval
+            time.sleep(max(0, next_send - time.monotonic()))
+
+        time.sleep(0.5)  # let the last acks arrive
+        client.disconnect()
+
+    def _ack(self, sent_at):
+        with self._lock:
+            self.latencies.append((time.perf_counter() - sent_at) * 1000)
+
+
+class ProcessMonitor(threading.Thread):
+    def __init__(self, pid, stop, interval=0.5):
+        """
+        Samples CPU and RSS of the server process from /proc.
+        """
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.stop = stop
+        self.interval = interval
+        self.cpu = []
+        self.rss_mb = []
+
+    def _cpu_seconds(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime and stime are fields 14 and 15 of the full line
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def _rss_mb(self):
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+        return None
+
+    def run(self):
+        if platform.system() != "Linux":
+            return
+        last_cpu = self._cpu_seconds()
+        last_time = time.monotonic()
+        while not self.stop.wait(self.interval):
+            try:
+                cpu = self._cpu_seconds()
+                rss = self._rss_mb()
+            except OSError:
+                return
+            now = time.monotonic()
+            self.cpu.append((cpu - last_cpu) / (now - last_time) * 100)
+            self.rss_mb.append(rss)
+            last_cpu, last_time = cpu, now
+
+    def result(self):
+        if not self.cpu:
+            return {'cpu_percent_mean': None, 'cpu_percent_max': None, 'rss_mb_max': None}
+        return {
+            'cpu_percent_mean': sum(self.cpu) / len(self.cpu),
+            'cpu_percent_max': max(self.cpu),
+            'rss_mb_max': max(self.rss_mb),
+        }
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def run(args):
+    base_url = f'http://127.0.0.1:{args.port}'
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(args.port),
+         '--width', str(args.width), '--height', str(args.height), '--fps', str(args.fps)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    try:
+        if not wait_for_port(args.port):
+            raise RuntimeError("Server did not start.")
+
+        stop = threading.Event()
+        monitor = ProcessMonitor(server.pid, stop)
+        viewers = [Viewer(base_url + '/video_feed', stop, slow=i < args.slow_viewers)
+                   for i in range(args.viewers)]
+        drivers = [Driver(base_url, stop, args.joystick_rate) for _ in range(args.drivers)]
+        for thread in [monitor] + viewers + drivers:
+            thread.start()
+
+        time.sleep(args.duration)
+        try:
+            memory = requests.get(base_url + '/stats/memory', timeout=5).json()
+        except (requests.RequestException, ValueError):
+            memory = {'pool': {}, 'gc_collections': [None]}
+        stop.set()
+        for thread in drivers + viewers:
+            thread.join(timeout=5)
+
+        latencies = [latency for driver in drivers for latency in driver.latencies]
+        viewer_results = [viewer.result() for viewer in viewers]
+        fast_fps = [v['fps'] for v in viewer_results if not v['slow']]
+        return {
+            'config': {
+                'viewers': args.viewers,
+                'slow_viewers': args.slow_viewers,
+                'drivers': args.drivers,
+                'joystick_rate': args.joystick_rate,
+                'duration': args.duration,
+                'width': args.width,
+                'height': args.height,
+                'fps': args.fps,
+            },
+            'summary': {
+                'viewer_fps_mean': sum(fast_fps) / len(fast_fps) if fast_fps else None,
+                'viewer_fps_min': min(fast_fps) if fast_fps else None,
+                'joystick_sent': sum(driver.sent for driver in drivers),
+                'joystick_acked': len(latencies),
+                'joystick_p50_ms': percentile(latencies, 50),
+                'joystick_p90_ms': percentile(latencies, 90),
+                'joystick_p99_ms': percentile(latencies, 99),
+                **monitor.result(),
+                # should stay near the number of buffers in flight, not grow with frames sent
+                'pool_allocations': memory['pool'].get('allocations'),
+                'gc_gen0_collections': memory['gc_collections'][0],
+            },
+            'viewers': viewer_results,
+            'driver_errors': [driver.error for driver in drivers if driver.error],
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=5)
+
+
+def compare(report, previous):
+    print(f"{'metric':<20} {'previous':>10} {'current':>10} {'change':>8}")
+    for key, value in report['summary'].items():
+        old = previous.get('summary', {}).get(key)
+        if value is None or old is None:
+            print(f"{key:<20} {str(old):>10} {str(value):>10}")
+            continue
+        change = f"{(value - old) / old * 100:+.0f}%" if old else ''
+        print(f"{key:<20} {old:>10.1f} {value:>10.1f} {change:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the rover web server with stub hardware.")
+    parser.add_argument('--viewers', type=int, default=4, help="MJPEG viewers")
+    parser.add_argument('--slow-viewers', type=int, default=1, help="How many of the viewers read slowly")
+    parser.add_argument('--drivers', type=int, default=2, help="Socket.IO clients sending joystick_move")
+    parser.add_argument('--joystick-rate', type=float, default=30, help="joystick_move events per second per driver")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds to run")
+    parser.add_argument('--width', type=int, default=960)
+    parser.add_argument('--height', type=int, default=540)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--report', default='loadtest_report.json', help="Where to write the JSON report")
+    parser.add_argument('--compare', help="Earlier report to compare against")
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        sys.exit(0)
+
+    report = run(args)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report['summary'], indent=2))
+    print(f"Report written to {args.report}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
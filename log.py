@@ -0,0 +1,203 @@
+"""
+
+Example:
+from log import get_logger, fields
+logger = get_logger(__name__)
+logger.info("Stream toggled", extra=fields(status=True))
+logger.debug("Joystick", extra=fields(forward=50, rightward=0, rate_limit=2))   # at most 2/s from this line
+logger.debug("Frame", extra=fields(seq=10, sample=0.01))                         # about 1 in 100
+
+Logging is set up with setup_logging() once at startup; until then records go
+through Python's default handling.
+
+"""
+
+import os
+import sys
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+
+ROOT_LOGGER = 'rover'
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+_listener = None
+_handler = None
+
+
+def get_logger(name):
+    """
+    Logger for a module, under the 'rover' logger so levels can be changed for all modules at once.
+    """
+    if name == '__main__':
+        name = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'main'
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def fields(rate_limit=None, sample=None, **values):
+    """
+    Build the `extra` argument for a log call.
+
+    Parameters:
+    rate_limit (float): Maximum records per second from this call site. Extra ones are dropped and counted.
+    sample (float): Fraction (0-1) of records from this call site that are kept.
+    **values: Key/value pairs written with the message.
+    """
+    return {'fields': values, 'rate_limit': rate_limit, 'sample': sample}
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self):
+        """
+        Drops records from hot call sites before they are queued. Limits are
+        opt-in per call with fields(rate_limit=..., sample=...). The next record
+        let through from a call site reports how many were suppressed.
+        """
+        super().__init__()
+        self._lock = threading.Lock()
+        self._sites = {}  # (pathname, lineno) -> [tokens, last_refill, suppressed]
+
+    def filter(self, record):
+        rate_limit = getattr(record, 'rate_limit', None)
+        sample = getattr(record, 'sample', None)
+        if rate_limit is None and sample is None:
+            return True
+
+        with self._lock:
+            burst = max(1, rate_limit or 0)
+            site = self._sites.setdefault((record.pathname, record.lineno), [burst, time.monotonic(), 0])
+            keep = True
+            if sample is not None and random.random() >= sample:
+                keep = False
+            if keep and rate_limit is not None:
+                # Token bucket holding up to one second worth of records
+                now = time.monotonic()
+                site[0] = min(burst, site[0] + (now - site[1]) * rate_limit)
+                site[1] = now
+                if site[0] >= 1:
+                    site[0] -= 1
+                else:
+                    keep = False
+            if not keep:
+                site[2] += 1
+                return False
+            if site[2]:
+                record.suppressed = site[2]
+                site[2] = 0
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        """
+        QueueHandler that never blocks the caller: when the queue is full the
+        record is dropped and counted instead.
+        """
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StructuredFormatter(logging.Formatter):
+    """
+    One logfmt line per record: time, level, logger, message, then any fields.
+    """
+
+    def format(self, record):
+        parts = [
+            f"ts={self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}",
+            f"level={record.levelname}",
+            f"logger={record.name[len(ROOT_LOGGER) + 1:] or ROOT_LOGGER}",
+            f"msg={self._quote(record.getMessage())}",
+        ]
+        for key, value in (getattr(record, 'fields', None) or {}).items():
+            parts.append(f"{key}={self._quote(value)}")
+        if getattr(record, 'suppressed', 0):
+            parts.append(f"suppressed={record.suppressed}")
+        line = ' '.join(parts)
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+    @staticmethod
+    def _quote(value):
+        if isinstance(value, float):
+            return f"{value:.3f}"
+        text = str(value)
+        if not text or any(c in text for c in ' ="\\\n\r\t'):
+            # Escaped so a multi-line value (e.g. an exception message) stays on the record's line
+            text = (text.replace('\\', '\\\\').replace('"', '\\"')
+                    .replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t'))
+            text = '"' + text + '"'
+        return text
+
+
+def setup_logging(level=None, max_queue=10000):
+    """
+    Route all rover loggers through a bounded queue to a background thread that
+    writes to stderr, so logging never waits on the console or journald.
+
+    Parameters:
+    level (str): Initial level. Defaults to $ROVER_LOG_LEVEL or INFO.
+    max_queue (int): Records held before new ones are dropped.
+    """
+    global _listener, _handler
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    output.setFormatter(StructuredFormatter())
+
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=max_queue))
+    _handler.addFilter(RateLimitFilter())
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.addHandler(_handler)
+    root.propagate = False
+    set_level(level or os.environ.get('ROVER_LOG_LEVEL', 'INFO'))
+
+
+def set_level(level, name=None):
+    """
+    Change the level of all rover loggers, or of one module's logger.
+    Raises ValueError for unknown levels.
+    """
+    level = str(level).upper()
+    if level not in LEVELS:
+        raise ValueError(f"Unknown log level: {level}")
+    logger = logging.getLogger(f"{ROOT_LOGGER}.{name}" if name else ROOT_LOGGER)
+    logger.setLevel(level)
+    return level
+
+
+def get_level():
+    return logging.getLevelName(logging.getLogger(ROOT_LOGGER).getEffectiveLevel())
+
+
+def dropped_records():
+    return _handler.dropped if _handler is not None else 0
+
+
+def _reset_after_fork():
+    # A forked child doesn't get the listener thread; drop the inherited queue so
+    # setup_logging() in the child starts its own instead of filling a queue nobody reads
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+    _listener = None
+    _handler = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,207 @@
+"""
+
+Differential drive mixing: joystick (forward, rightward) -> wheel duty cycles and directions.
+
+Example:
+from mixer import CalibrationProfile, MixingTable
+profile = CalibrationProfile.load('mix_profile.json')
+table = MixingTable(profile)
+left_duty, right_duty, left_direction, right_direction = table.lookup(50, 20)
+
+Generate a profile:
+python mixer.py generate --out mix_profile.json --left-trim 0.95 --min-duty 25 --expo 0.3
+python mixer.py show --profile mix_profile.json
+
+"""
+
+import json
+import argparse
+import numpy as np
+
+FORWARD = 1
+BACKWARD = -1
+
+
+class CalibrationProfile:
+    # Defaults reproduce the original hard-coded behaviour
+    DEFAULTS = {
+        'forward_deadband': 20,    # |forward| at or below this is treated as 0
+        'rightward_deadband': 15,  # |rightward| at or below this is treated as 0
+        'spin_threshold': 20,      # spin in place when |forward| <= this and |rightward| > this
+        'spin_cap': 75,            # maximum duty while spinning
+        'turn_factor': 0.8,        # how much rightward slows the inner wheel
+        'expo': 0.0,               # 0 = linear stick, 1 = fully cubic (finer control near center)
+        'left_trim': 1.0,          # duty multiplier to match mismatched motors
+        'right_trim': 1.0,
+        'min_duty': 0,             # duty at which the motors start turning; non-zero output is scaled above it
+    }
+    # Allowed (min, max) per value, None for no bound
+    RANGES = {
+        'forward_deadband': (0, None),
+        'rightward_deadband': (0, None),
+        'spin_threshold': (0, None),
+        'spin_cap': (0, 100),
+        'turn_factor': (0, None),
+        'expo': (0, 1),
+        'left_trim': (0, None),
+        'right_trim': (0, None),
+        'min_duty': (0, 100),
+    }
+
+    def __init__(self, **values):
+        """
+        Calibration values for the mixing table. Unknown keys and values out of
+        range raise ValueError.
+        """
+        unknown = set(values) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown calibration values: {sorted(unknown)}")
+        for key, default in self.DEFAULTS.items():
+            value = type(default)(values.get(key, default))
+            low, high = self.RANGES[key]
+            # Written as a negation so NaN is rejected too
+            if not ((low is None or value >= low) and (high is None or value <= high)):
+                bounds = f"between {low} and {high}" if high is not None else f"at least {low}"
+                raise ValueError(f"{key} must be {bounds}, got {value}.")
+            setattr(self, key, value)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.DEFAULTS}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class MixingTable:
+    def __init__(self, profile=None):
+        """
+        Precomputes wheel duty cycles and directions for every integer
+        (forward, rightward) in -100..100, so a move is a single lookup.
+
+        Parameters:
+        profile (CalibrationProfile): Calibration to apply. Defaults to CalibrationProfile().
+        """
+        self.profile = profile or CalibrationProfile()
+        p = self.profile
+
+        axis = np.arange(-100, 101, dtype=np.float64)
+        forward, rightward = np.meshgrid(axis, axis, indexing='ij')
+
+        # Deadbands
+        forward = np.where(np.abs(forward) <= p.forward_deadband, 0, forward)
+        rightward = np.where(np.abs(rightward) <= p.rightward_deadband, 0, rightward)
+        # Spin is decided on the stick position, before the expo curve
+        spinning = (np.abs(forward) <= p.spin_threshold) & (np.abs(rightward) > p.spin_threshold)
+        forward = self._expo(forward, p.expo)
+        rightward = self._expo(rightward, p.expo)
+
+        # Driving: both wheels follow the sign of forward, the inner wheel slows down to turn
+        forward_abs = np.abs(forward)
+        turn = np.minimum(forward_abs, np.abs(rightward)) * p.turn_factor
+        left = np.where(rightward < 0, forward_abs - turn, forward_abs)
+        right = np.where(rightward >= 0, forward_abs - turn, forward_abs)
+        drive_direction = np.where(forward > 0, FORWARD, BACKWARD)
+        left_direction = drive_direction
+        right_direction = drive_direction
+
+        # Spinning: wheels turn opposite ways
+        spin_power = np.minimum(np.abs(rightward), p.spin_cap)
+        left = np.where(spinning, spin_power, left)
+        right = np.where(spinning, spin_power, right)
+        left_direction = np.where(spinning, np.where(rightward > 0, FORWARD, BACKWARD), left_direction)
+        right_direction = np.where(spinning, np.where(rightward > 0, BACKWARD, FORWARD), right_direction)
+
+        self.left_duty = self._calibrate(left, p.left_trim, p.min_duty)
+        self.right_duty = self._calibrate(right, p.right_trim, p.min_duty)
+        self.left_direction = left_direction.astype(np.int8)
+        self.right_direction = right_direction.astype(np.int8)
+
+    @staticmethod
+    def _expo(values, expo):
+        return (1 - expo) * values + expo * values ** 3 / 100 ** 2
+
+    @staticmethod
+    def _calibrate(duty, trim, min_duty):
+        duty = np.clip(duty * trim, 0, 100)
+        return np.where(duty > 0, min_duty + (100 - min_duty) * duty / 100, 0).round(2)
+
+    def lookup(self, forward, rightward):
+        """
+        Return (left_duty, right_duty, left_direction, right_direction) for
+        joystick values in -100..100. Directions are FORWARD or BACKWARD.
+        """
+        i = int(round(max(-100, min(100, forward)))) + 100
+        j = int(round(max(-100, min(100, rightward)))) + 100
+        return (float(self.left_duty[i, j]), float(self.right_duty[i, j]),
+                int(self.left_direction[i, j]), int(self.right_direction[i, j]))
+
+
+def find_min_duty(motor_driver, step=5, pause=1.0):
+    """
+    Run both wheels at increasing duty until the user says they turn. Returns the
+    duty to use as min_duty. Runs on the rover, wheels off the ground.
+    """
+    import time
+    for duty in range(step, 101, step):
+        motor_driver.apply(duty, duty, FORWARD, FORWARD)
+        time.sleep(pause)
+        if input(f"Duty {duty}%: are both wheels turning? [y/N] ").strip().lower() == 'y':
+            motor_driver.stop()
+            return duty
+    motor_driver.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate or inspect a motor mixing profile.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="Write a calibration profile")
+    generate.add_argument('--out', default='mix_profile.json')
+    generate.add_argument('--base', help="Existing profile to start from")
+    for key, default in CalibrationProfile.DEFAULTS.items():
+        generate.add_argument('--' + key.replace('_', '-'), type=type(default))
+    generate.add_argument('--measure-min-duty', action='store_true',
+                          help="Find min_duty by running the motors (on the rover)")
+
+    show = commands.add_parser('show', help="Print the mix for a grid of joystick positions")
+    show.add_argument('--profile')
+    show.add_argument('--step', type=int, default=25)
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        values = CalibrationProfile.load(args.base).to_dict() if args.base else {}
+        for key in CalibrationProfile.DEFAULTS:
+            if getattr(args, key) is not None:
+                values[key] = getattr(args, key)
+        if args.measure_min_duty:
+            from motor import MotorDriver
+            motor = MotorDriver(in1_pin=24, in2_pin=23, ena_pin=12, in3_pin=22, in4_pin=27, enb_pin=18)
+            try:
+                values['min_duty'] = find_min_duty(motor)
+            finally:
+                motor.cleanup()
+        profile = CalibrationProfile(**values)
+        profile.save(args.out)
+        print(f"Profile written to {args.out}: {profile.to_dict()}")
+
+    elif args.command == 'show':
+        table = MixingTable(CalibrationProfile.load(args.profile) if args.profile else None)
+        names = {FORWARD: 'F', BACKWARD: 'B'}
+        for forward in range(100, -101, -args.step):
+            row = []
+            for rightward in range(-100, 101, args.step):
+                left, right, left_direction, right_direction = table.lookup(forward, rightward)
+                row.append(f"{names[left_direction]}{left:3.0f}/{names[right_direction]}{right:3.0f}")
+            print(f"{forward:5d} | " + ' '.join(row))
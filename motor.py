@@ -9,12 +9,20 @@ motor.cleanup()
 
 """
 
+import os
 import time
 import RPi.GPIO as GPIO
 
+from mixer import CalibrationProfile, MixingTable, FORWARD
+from pwm import create_pwm_pair
+from log import get_logger, fields, setup_logging
+
+logger = get_logger(__name__)
+
 
 class MotorDriver:
-    def __init__(self, in1_pin, in2_pin, ena_pin, in3_pin, in4_pin, enb_pin):
+    def __init__(self, in1_pin, in2_pin, ena_pin, in3_pin, in4_pin, enb_pin, profile_path=None,
+                 pwm_backend='auto', pwm_frequency=1000):
         """
         Initializes the MotorDriver with the specified GPIO pins for motor control.
 
@@ -25,6 +33,10 @@ class MotorDriver:
         in3_pin (int): GPIO pin for IN3 of the left motor.
         in4_pin (int): GPIO pin for IN4 of the left motor.
         enb_pin (int): GPIO pin for ENB (enable) of the left motor.
+        profile_path (str): Calibration profile (see mixer.py). Defaults are used if not given or missing.
+        pwm_backend (str): 'auto', 'pigpio', 'sysfs', 'rpigpio' or 'mock' (see pwm.py). 'auto' uses
+                           hardware PWM when ENA/ENB are on different hardware channels.
+        pwm_frequency (int): PWM frequency in Hz.
         """
         # Right motor (A)
         self.in1 = in1_pin
@@ -37,15 +49,42 @@ class MotorDriver:
         self.enB = enb_pin
 
         GPIO.setmode(GPIO.BCM)
-        # Setup Motor A and B in a loop
-        for pin in [self.in1, self.in2, self.enA, self.in3, self.in4, self.enB]:
+        # Setup Motor A and B direction pins in a loop. The enable pins are set up by the PWM backend.
+        for pin in [self.in1, self.in2, self.in3, self.in4]:
             GPIO.setup(pin, GPIO.OUT)
 
         # Initialize PWM for motor speed control
-        self.pwm_right = GPIO.PWM(self.enA, 1000)  # Frequency set to 1kHz
-        self.pwm_left = GPIO.PWM(self.enB, 1000)  # Frequency set to 1kHz
+        self.pwm_right, self.pwm_left = create_pwm_pair(pwm_backend, [self.enA, self.enB], pwm_frequency)
         self.pwm_right.start(0)
         self.pwm_left.start(0)
+        # Last duty cycles applied, read by telemetry
+        self.right_duty = 0
+        self.left_duty = 0
+        # Current pin directions, so pins are only written when they change
+        self._directions = {'right': None, 'left': None}
+
+        self.profile_path = profile_path
+        self.mixer = MixingTable()
+        if profile_path:
+            if os.path.exists(profile_path):
+                self.load_profile(profile_path)
+            else:
+                logger.info("Mixing profile not found, using defaults", extra=fields(path=profile_path))
+
+    def load_profile(self, profile):
+        """
+        Build a mixing table from a profile path, dict or CalibrationProfile and
+        swap it in. Moves in progress keep using the old table until it is ready.
+        """
+        if profile is None:
+            raise ValueError("no profile to load")
+        if isinstance(profile, str):
+            self.profile_path = profile
+            profile = CalibrationProfile.load(profile)
+        elif isinstance(profile, dict):
+            profile = CalibrationProfile.from_dict(profile)
+        self.mixer = MixingTable(profile)
+        logger.info("Mixing profile loaded", extra=fields(**self.mixer.profile.to_dict()))
 
     def _set_motor_direction(self, motor, direction):
         """
@@ -71,21 +110,6 @@ class MotorDriver:
         else:
             raise ValueError("Direction must be 'forward' or 'backward'")
 
-    def _set_direction(self, forward):
-        """
-        Set the direction for both motors based on the sign of forward.
-        """
-        if forward > 0:  # Forward
-            self._set_motor_direction('right', 'forward')
-            self._set_motor_direction('left', 'forward')
-            print("Moving forward")
-        else:  # Backward
-            self._set_motor_direction('right', 'backward')
-            self._set_motor_direction('left', 'backward')
-            print("Moving backward")
-
-        return abs(forward)
-
     def move(self, forward, rightward):
         """
         Moves the motors based on the forward and rightward values as percentages (-100 to 100).
@@ -94,63 +118,37 @@ class MotorDriver:
         forward (int): The forward movement value. Positive for forward, negative for backward.
         rightward (int): The rightward movement value. Positive for right, negative for left.
 
-        The method calculates the power for both motors to achieve the desired movement.
+        Wheel powers and directions come from the precomputed mixing table, which
+        applies the deadbands, spin mode, turn factor and calibration (see mixer.py).
         """
-        # Ensure forward and rightward values are within the range -100 to 100
-        forward = max(-100, min(100, forward))
-        rightward = max(-100, min(100, rightward))
-        is_spinning = False
-        print(f"Initial | forward: {forward}, rightward: {rightward}")
-
-        # SPIN move: forward has to be within 20. Rightward more thant 20.
-        if -20 <= forward <= 20 and (rightward < -20 or rightward > 20):
-            is_spinning = True
-            left_motor_direction = 'forward' if rightward > 0 else 'backward'
-            right_motor_direction = 'backward' if rightward > 0 else 'forward'
-
-            print(f"Left motor direction: {left_motor_direction}, Right motor direction: {right_motor_direction}")
-            self._set_motor_direction('left', left_motor_direction)
-            self._set_motor_direction('right', right_motor_direction)
-
-            # Limits spin motion to 75% cycle
-            left_motor_power = min(abs(rightward), 75)
-            right_motor_power = min(abs(rightward), 75)
-
-        if is_spinning:
-            # set one motor forward and the other backwards
-            print("Spinning right" if left_motor_direction=='forward' else "Spinning left")
+        left_motor_power, right_motor_power, left_direction, right_direction = self.mixer.lookup(forward, rightward)
+        self.apply(left_motor_power, right_motor_power, left_direction, right_direction)
+        logger.debug("Applied", extra=fields(forward=forward, rightward=rightward, left_motor_power=left_motor_power,
+                                             right_motor_power=right_motor_power, rate_limit=2))
 
-        else:
-            # Configure the motors to move in one direction based on the sign of forward
-            # The sign of "forward" doesn't matter for right-left calculations.
-            forward_abs = self._set_direction(forward)
-            if rightward >= 0:
-                # Limit rightward to not exceed forward_abs.
-                # Set left motor to maximum forward power.
-                # Set right motor to maximum forward power minus rightward power.
-                rightward = min(forward_abs, rightward)
-                left_motor_power = forward_abs
-                right_motor_power = forward_abs - (rightward * 0.8)
-
-            elif rightward < 0:
-                # Limit rightward to not exceed forward_abs.
-                # Set right motor to maximum forward power.
-                # Set left motor to maximum forward power plus the negative rightward power.
-                rightward = (-1) * min(forward_abs, abs(rightward))
-                right_motor_power = forward_abs
-                left_motor_power = forward_abs + (rightward * 0.8)
+    def apply(self, left_motor_power, right_motor_power, left_direction, right_direction):
+        """
+        Set wheel directions (mixer.FORWARD/BACKWARD) and duty cycles directly.
+        """
+        for motor, direction in (('left', left_direction), ('right', right_direction)):
+            if self._directions[motor] != direction:
+                self._set_motor_direction(motor, 'forward' if direction == FORWARD else 'backward')
+                self._directions[motor] = direction
 
         # Apply the calculated duty cycles to PWM
-        self.pwm_right.ChangeDutyCycle(right_motor_power)
-        self.pwm_left.ChangeDutyCycle(left_motor_power)
-        print(f"Applied | right_motor_power: {right_motor_power}, left_motor_power: {left_motor_power}")
+        self.pwm_right.set_duty(right_motor_power)
+        self.pwm_left.set_duty(left_motor_power)
+        self.right_duty = right_motor_power
+        self.left_duty = left_motor_power
 
     def stop(self):
         """
         Stops both motors.
         """
-        self.pwm_right.ChangeDutyCycle(0)
-        self.pwm_left.ChangeDutyCycle(0)
+        self.pwm_right.set_duty(0)
+        self.pwm_left.set_duty(0)
+        self.right_duty = 0
+        self.left_duty = 0
 
     def cleanup(self):
         """
@@ -159,32 +157,35 @@ class MotorDriver:
         self.pwm_right.stop()
         self.pwm_left.stop()
         GPIO.cleanup()
+        self._directions = {'right': None, 'left': None}
 
 
 if __name__ == "__main__":
-    # GPIO18 shares same PWM channel as GPIO12
+    setup_logging('DEBUG')
+    # GPIO18 shares same PWM channel as GPIO12, so this wiring uses software PWM.
+    # Moving ENB to GPIO13 lets pwm_backend='auto' use hardware PWM.
     motor = MotorDriver(in1_pin=24, in2_pin=23, ena_pin=12, in3_pin=22, in4_pin=27, enb_pin=18)
     motor.stop()
 
-    print("Test 1: Move forward 50%")
+    logger.info("Test 1: Move forward 50%")
     motor.move(50, 0)  # Move forward at 50% speed
     time.sleep(2)
     motor.stop()
     time.sleep(2)
 
-    print("Test 3: Move back 50%")
+    logger.info("Test 3: Move back 50%")
     motor.move(-50, 0)  # Move backward at 50% speed
     time.sleep(2)
     motor.stop()
     time.sleep(2)
 
-    print("Test 4: Move forward 50 and rigth 50%")
+    logger.info("Test 4: Move forward 50 and rigth 50%")
     motor.move(50, 20)  # Move backward at 50% speed
     time.sleep(2)
     motor.stop()
     time.sleep(2)
 
-    print("Test 5: Move back 50 and left 50%")
+    logger.info("Test 5: Move back 50 and left 50%")
     motor.move(50, -20)  # Move backward at 50% speed
     time.sleep(2)
     motor.stop()
@@ -6,7 +6,10 @@ channels = 3            # number of channels for an RGB image
 # Frame configuration
 frames_to_skip = 8     # Number of frames to skip classification
 fps = '30'              # number of frames per seconds to get from camera sensor
-stickiness = 20
+track_max_age = 1.0     # seconds a tracked detection is kept without a new matching detection
+
+# detector
+detector_workers = 2    # model runner processes; with more, frames_to_skip can be lowered
 
 # detection
 detection_threshold = 0.0
@@ -1,56 +1,55 @@
 import sys
 import cv2
-import queue
+import time
 import signal
+import threading
 import platform
 import subprocess
-import numpy as np
 import multiprocessing
-from flask import Flask, Response
+from functools import partial
+from flask import Flask, Response, jsonify
 from edge_impulse_linux.image import ImageImpulseRunner
 
 from secrets import api_key
-from old_files.config import (width, height, channels, frames_to_skip, fps, upload_threshold, stickiness)
+from old_files.config import (width, height, channels, frames_to_skip, fps, upload_threshold, track_max_age,
+                              detector_workers)
 from utils import upload_image_to_edge_impulse
 from open_rover.camera import CameraHandler
+from open_rover.tracker import BoxTracker
+from open_rover.detector_pool import DetectorPool
+from open_rover.pipeline import FramePipeline
+from open_rover.log import get_logger, fields, setup_logging
+
+logger = get_logger(__name__)
 
 app = Flask(__name__)
 
 # queues 
-in_queue = multiprocessing.Queue(maxsize=10)
-out_queue = multiprocessing.Queue(maxsize=10)
 up_queue = multiprocessing.Queue(maxsize=10)
 
 # Correctly defining the image shape
 image_shape = (height, width, channels)
-image_dtype = np.uint8
-
-# Create shared array with a lock for parallel processing
-lock = multiprocessing.Lock()
-shared_array_base = multiprocessing.Array('B', int(np.prod(image_shape)), lock=lock)
-shared_array = np.frombuffer(shared_array_base.get_obj(), dtype=image_dtype).reshape(image_shape)
 
 # Get the model path from the command-line argument
 if len(sys.argv) < 2:
-    print("Usage: python streamer.py <MODEL_PATH> <0_1 for DEBUG> <0_1 for Upload to EI>")
-    sys.exit(1)
+    sys.exit("Usage: python streamer.py <MODEL_PATH> <0_1 for DEBUG> <0_1 for Upload to EI>")
 
 MODEL_PATH      = sys.argv[1]
 DEBUG           = int(sys.argv[2])
 UPLOAD_TO_EI    = int(sys.argv[3])
 
 # Handle termination of subprocesses with ctrl + C
-def signal_handler():
-    print("Termination signal received. Cleaning up...")
-    in_queue.put(None)  # Sentinel to stop the classification_worker process
-    classification_process.join()
-    up_queue.put(None)  # Sentinel to stop the uploader_process process
+def signal_handler(*args):
+    logger.info("Termination signal received. Cleaning up...")
+    detector_pool.close()  # Stops every classification worker process
+    up_queue.put((None, None))  # Sentinel to stop the uploader_process process
     uploader_process.join()
-    print("Subprocesses terminated.")
+    logger.info("Subprocesses terminated.")
     sys.exit(0)
 
 def upload_worker(up_queue):
     global UPLOAD_TO_EI
+    setup_logging()
 
     while True:
         image_to_upload, bounding_boxes = up_queue.get()
@@ -58,150 +57,142 @@ def upload_worker(up_queue):
             break
         try:
             if UPLOAD_TO_EI:
-                print(upload_image_to_edge_impulse(image_to_upload, api_key, bounding_boxes, MODEL_PATH))
+                response = upload_image_to_edge_impulse(image_to_upload, api_key, bounding_boxes, MODEL_PATH)
+                logger.info("Image uploaded", extra=fields(response=response))
         except Exception as e:
-            print(f"Upload failed: {e}")
-
-def classification_worker(in_queue, out_queue, up_queue, shared_array_base, array_shape, dtype, lock):
-    global upload_threshold
-
-    runner = ImageImpulseRunner(MODEL_PATH)
-    try:
-        runner.init()
-    except Exception as init_error:
-        # out_queue.put(('init_error', str(init_error)))
-        print('classification worker error: init_error', str(init_error))
-        return
-
-    # Attach to the shared array
-    shared_array = np.frombuffer(shared_array_base.get_obj(), dtype=dtype).reshape(array_shape)
-
-    while True:
-        try:
-            frame_number = in_queue.get()
-            if frame_number is None:  # Sentinel value to end the process
-                break
-
-            # Read from shared array with lock
-            with lock:
-                image = shared_array.copy()
-
-            # Convert image to RGB
-            # TODO: test if this is needed?
-            frame_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-            # Extract features from the image using the runner's built-in method
-            try:
-                features, cropped = runner.get_features_from_image(frame_rgb)
-            except Exception as feature_error:
-                # out_queue.put((frame_number, 'feature_extraction_error', str(feature_error)))
-                print("Error getting features")
-                continue
-
-            # Run inference and catch any issues during classification
-            try:
-                result = runner.classify(features)
-                # if there's any detections
-                if len(result["result"]["bounding_boxes"]) > 0:
-                    # Send them to draw bounding boxes
-                    bounding_boxes = result["result"]["bounding_boxes"]
-                    out_queue.put((frame_number, bounding_boxes))
-                    if DEBUG:
-                        print(bounding_boxes)
-                    # Create an array of all predicted prob 'value'
-                    confidence_values = [bb['value'] for bb in result["result"]["bounding_boxes"]]
-                    # Upload if there's a detection with matching confidence
-                    if any(value <= upload_threshold for value in confidence_values):
-                        # Upload to Edge Impulse
-                        up_queue.put((image, result["result"]["bounding_boxes"]))
-                    
-            except Exception as classify_error:
-                print("Classification error: ", classify_error)
-                # out_queue.put((frame_number, 'classification_error', str(classify_error)))
-
-        except Exception as e:
-            print("Some unspecific error whilst classifying: ", e)
-            # out_queue.put((None, 'general_error', str(e)))
+            logger.warning("Upload failed", extra=fields(error=e, rate_limit=1))
+
+def queue_for_upload(up_queue, image, result):
+    # Runs in the detector workers after each classification
+    setup_logging('DEBUG' if DEBUG else None)  # Once per worker
+    bounding_boxes = result["result"]["bounding_boxes"]
+    if bounding_boxes:
+        logger.debug("Detections", extra=fields(bounding_boxes=bounding_boxes, rate_limit=5))
+    # Upload if there's a detection with matching confidence
+    if any(bb['value'] <= upload_threshold for bb in bounding_boxes) and not up_queue.full():
+        # The image is the worker's shared slot, copy it before it is reused
+        up_queue.put((image.copy(), bounding_boxes))
+
+# Several model runner processes; frames go to whichever one is free
+detector_pool = DetectorPool(
+    partial(ImageImpulseRunner, MODEL_PATH),
+    image_shape,
+    workers=detector_workers,
+    on_result=partial(queue_for_upload, up_queue),
+    max_age=track_max_age,
+)
+
+class DetectionGate:
+    def __init__(self):
+        # Pipeline workers finish decoding out of order; the pool wants increasing frame numbers
+        self.lock = threading.Lock()
+        self.last_submitted = -1
+
+    def submit(self, frame_number, image, captured_at):
+        with self.lock:
+            if frame_number <= self.last_submitted:
+                return False  # A newer frame got there first
+            if detector_pool.submit(frame_number, image, captured_at=captured_at):  # False if every worker is busy
+                self.last_submitted = frame_number
+                return True
+            return False
+
+def release_item(item):
+    # Pipeline discard hook: hand the camera buffer back for frames that won't be sent
+    frame = item.pop('frame', None)
+    if frame is not None:
+        frame.release()
 
 def yield_frames():
-    global shared_array, frames_to_skip, fps, width, height, stickiness
-    latest_result = False
+    global frames_to_skip, fps, width, height, track_max_age
     frame_count = 0
+    # Detections only arrive every few frames; the tracker moves the boxes in between
+    tracker = BoxTracker(max_age=track_max_age)
+    gate = DetectionGate()
+
+    def decode(item):
+        item['image'] = cam.decode_frame(item['frame'])
+        if item['image'] is None:
+            release_item(item)
+            return None
+        if item['detect']:
+            gate.submit(item['number'], item['image'], item['captured_at'])
+        return item
+
+    def annotate(item):
+        if item['boxes']:
+            item['image'] = cam.draw_bounding_boxes(item['image'], item['boxes'])
+        return item
+
+    def encode(item):
+        # Re-encode the modified image back to JPEG format
+        ok, jpeg_frame = cv2.imencode('.jpg', item['image'])
+        release_item(item)
+        if not ok:
+            return None
+        item['jpeg'] = jpeg_frame
+        return item
 
     # Initialize the camera handler
     cam = CameraHandler(width=width, height=height, fps=fps)  # fps can be adjusted if needed
-    
+    # Decode, overlays and encode run on a worker pool, frames come back in capture order
+    pipeline = FramePipeline([('decode', decode), ('annotate', annotate), ('encode', encode)],
+                             discard=release_item)
+
     try:
         while True:
-            # Get a still image using the CameraHandler class
-            decoded_image = cam.get_still()
+            # The JPEG from libcamera-vid (or the image from OpenCV), decoded in the pipeline
+            frame = cam.get_frame()
 
-            if decoded_image is None:
-                print(f"Failed to retrieve frame...")
+            if frame is None:
+                logger.warning("Failed to retrieve frame", extra=fields(rate_limit=1))
                 continue
+            now = cam.captured_at or time.monotonic()
 
-            if frame_count % frames_to_skip == 0:
-                if not in_queue.full():
-                    # Write decoded image to shared array with lock
-                    with lock:
-                        shared_array[:] = decoded_image[:]
-
-                    in_queue.put(frame_count)
-
-            # Check and handle the output queue for results
+            # Detections come back in frame order, stamped with their frame's capture time
             try:
-                while not out_queue.empty():
-                    latest_result = out_queue.get_nowait()
-                if latest_result:
-                    result_frame_number, bounding_boxes = latest_result
-                    decoded_image = cam.draw_bounding_boxes(decoded_image, bounding_boxes)
-                    # stop plotting the predictions after 15 frames
-                    if frame_count % stickiness == 0:
-                        latest_result = None
-
-            except queue.Empty:
-                pass
+                for result_frame_number, bounding_boxes, captured_at in detector_pool.poll():
+                    if bounding_boxes:
+                        tracker.update(bounding_boxes, captured_at)
             except Exception as e:
-                print("Error whilst getting output queue: ", e)
-                print("latest result: ", latest_result)
+                frame.release()
+                logger.error("Error whilst getting detection results", extra=fields(error=e))
                 break
 
-            # Re-encode the modified image back to JPEG format
-            _, jpeg_frame = cv2.imencode('.jpg', decoded_image)
-            modified_jpeg_frame = jpeg_frame.tobytes()
-
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + modified_jpeg_frame + b'\r\n')
-
+            pipeline.submit({
+                'number': frame_count, 'frame': frame, 'captured_at': now,
+                # Skipped if every detector worker is still busy
+                'detect': frame_count % frames_to_skip == 0,
+                'boxes': tracker.predict(now),
+            })
             frame_count += 1
 
+            for item in pipeline.pop_ready(timeout=0.02):
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + item['jpeg'].tobytes() + b'\r\n')
+
     except Exception as e:
-        print(f"Error while generating frames: {e}")
+        logger.error("Error while generating frames", extra=fields(error=e))
 
     finally:
+        pipeline.close()
         cam.shut_down()
 
 @app.route('/')
 def index():
     return Response(yield_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/stats/detector')
+def detector_stats():
+    # Per-worker throughput, inference time and queue wait
+    return jsonify(detector_pool.stats())
+
 if __name__ == "__main__":
+    setup_logging('DEBUG' if DEBUG else None)
     # Register the signal handler for SIGINT (Ctrl+C)
     signal.signal(signal.SIGINT, signal_handler)
-    # Start classification worker process
-    classification_process = multiprocessing.Process(
-            target=classification_worker, 
-            args=(
-                in_queue,
-                out_queue,
-                up_queue,
-                shared_array_base,
-                image_shape,
-                image_dtype,
-                lock
-            )
-        )
-    classification_process.start()
+    # Start the classification worker processes
+    detector_pool.start()
     # start the uploader worker process
     uploader_process = multiprocessing.Process(
             target=upload_worker, 
@@ -216,13 +207,13 @@ if __name__ == "__main__":
     elif system == "Darwin":
         app_port = 5001
     else:
-        print(f"Unsupported system: {system}")
+        logger.error("Unsupported system", extra=fields(system=system))
         exit(1)
 
     try:
         # Start running the application
         app.run(host='0.0.0.0', port=app_port)
     except Exception as e:
-        print(f"Error occurred: {e}")
+        logger.error("Error occurred", extra=fields(error=e))
     finally:
         signal_handler()  # Call the signal handler to clean up
\ No newline at end of file
@@ -5,13 +5,16 @@ import numpy as np
 from datetime import datetime
 
 from secrets import api_key
+from open_rover.log import get_logger, fields, setup_logging
+
+logger = get_logger(__name__)
 
 def upload_image_to_edge_impulse(image, api_key, bounding_boxes, model_version):
     """
         Upload an in-memory image to Edge Impulse using the provided API key and project ID.
     """
     if not isinstance(image, np.ndarray):
-        print("Error: The input image is not a valid numpy array.")
+        logger.error("Upload skipped: the input image is not a valid numpy array", extra=fields(type=type(image).__name__))
         return
     
     # Ensure the image is in uint8 format
@@ -21,7 +24,7 @@ def upload_image_to_edge_impulse(image, api_key, bounding_boxes, model_version):
     # Convert the image to JPEG format in memory
     success, image_encoded = cv2.imencode('.jpg', image)
     if not success:
-        print("Error: Failed to encode the image.")
+        logger.error("Upload skipped: failed to encode the image")
         return
 
     image_bytes = image_encoded.tobytes()
@@ -90,7 +93,7 @@ def test_upload_image_to_edge_impulse():
 
     # Check if the image was loaded correctly
     if image is None:
-        print(f"Failed to load image from {image_path}")
+        logger.error("Failed to load image", extra=fields(path=image_path))
         return
 
     # Define mock bounding boxes
@@ -103,8 +106,9 @@ def test_upload_image_to_edge_impulse():
 
     # Call the function and print the result
     result = upload_image_to_edge_impulse(image, api_key, mock_bounding_boxes, model_version)
-    print(result)
+    logger.info("Upload result", extra=fields(result=result))
 
 if __name__ == "__main__":
+    setup_logging()
     # test 1: test upload to EI
     test_upload_image_to_edge_impulse()
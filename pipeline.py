@@ -0,0 +1,242 @@
+"""
+
+Example:
+from pipeline import FramePipeline
+pipeline = FramePipeline([('decode', decode), ('annotate', annotate), ('encode', encode)])
+pipeline.submit(jpeg_bytes)
+for frame in pipeline.pop_ready():
+    send(frame)
+pipeline.close()
+
+"""
+
+import os
+import time
+import threading
+from collections import deque
+
+from log import get_logger, fields
+
+logger = get_logger(__name__)
+
+
+class FramePipeline:
+    def __init__(self, stages, workers=None, max_in_flight=None, discard=None):
+        """
+        Runs a fixed list of per-frame stages on a pool of worker threads and
+        releases the results in the order the frames were submitted.
+
+        Each worker takes one frame and runs every stage on it, so frames are
+        processed in parallel while the stages of a single frame stay sequential.
+        OpenCV releases the GIL inside imdecode/imencode and the drawing calls,
+        which is where the time goes, so threads are enough to use all cores.
+
+        Parameters:
+        stages (list): (name, callable) pairs. Each callable takes the output of the
+                       previous stage. Returning None drops the frame.
+        workers (int): Number of worker threads. Defaults to the number of cores.
+        max_in_flight (int): Maximum number of frames queued or being processed,
+                             at least `workers`. When full, the oldest queued frame
+                             is dropped, or the new one if every frame is in a worker.
+        discard (callable): Called with each frame that will not be released:
+                            dropped, failed, or left over on close (the last
+                            stage's result if it had finished). Used to hand
+                            pooled buffers back.
+        """
+        self.stages = list(stages)
+        self.discard = discard
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers * 2
+        if self.max_in_flight < self.workers:
+            raise ValueError(f"max_in_flight ({self.max_in_flight}) can't be less than workers ({self.workers}).")
+
+        self._lock = threading.Lock()
+        self._work_ready = threading.Condition(self._lock)
+        self._frame_done = threading.Condition(self._lock)
+        self._pending = deque()  # (seq, frame) waiting for a worker
+        self._done = {}          # seq -> result (None if the frame was dropped)
+        self._in_flight = 0
+        self._next_seq = 0
+        self._next_release = 0
+        self._running = True
+
+        self._started_at = time.monotonic()
+        self._stage_busy = {name: 0.0 for name, _ in self.stages}
+        self._stage_calls = {name: 0 for name, _ in self.stages}
+        self._submitted = 0
+        self._released = 0
+        self._dropped = 0
+        self._failed = 0
+
+        self._threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"pipeline-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, frame):
+        """
+        Queue a frame for processing. Never blocks: under overload the oldest
+        frame that no worker has picked up yet is dropped to make room. If every
+        frame in flight is already in a worker, the new frame is dropped instead.
+        """
+        with self._lock:
+            dropped = None
+            seq = self._next_seq
+            self._next_seq += 1
+            self._submitted += 1
+            if self._in_flight >= self.max_in_flight and not self._pending:
+                # Nothing queued to make room with
+                dropped = frame
+                self._done[seq] = None
+                self._dropped += 1
+                self._frame_done.notify_all()
+            else:
+                if self._in_flight >= self.max_in_flight:
+                    dropped_seq, dropped = self._pending.popleft()
+                    self._done[dropped_seq] = None
+                    self._in_flight -= 1
+                    self._dropped += 1
+                    self._frame_done.notify_all()
+                self._in_flight += 1
+                self._pending.append((seq, frame))
+                self._work_ready.notify()
+        if dropped is not None:
+            self._discard(dropped)
+        return seq
+
+    def _discard(self, frame):
+        if self.discard is None:
+            return
+        try:
+            self.discard(frame)
+        except Exception as e:
+            logger.warning("Pipeline discard failed", extra=fields(error=e, rate_limit=1))
+
+    def pop_ready(self, timeout=0):
+        """
+        Return the processed frames that can be released in capture order.
+        Frames that were dropped or failed are skipped without holding back
+        the frames after them.
+
+        Parameters:
+        timeout (float): Seconds to wait for the oldest frame in flight to finish
+                         when nothing is ready yet, so it is sent as soon as it is
+                         done rather than when the next frame is submitted.
+        """
+        ready = []
+        with self._lock:
+            if timeout > 0 and self._next_release not in self._done and self._next_release < self._next_seq:
+                self._frame_done.wait_for(lambda: self._next_release in self._done or not self._running, timeout)
+            while self._next_release in self._done:
+                result = self._done.pop(self._next_release)
+                self._next_release += 1
+                if result is not None:
+                    ready.append(result)
+                    self._released += 1
+        return ready
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while self._running and not self._pending:
+                    self._work_ready.wait()
+                if not self._running:
+                    return
+                seq, frame = self._pending.popleft()
+
+            result = frame
+            timings = []
+            try:
+                for name, stage in self.stages:
+                    start = time.perf_counter()
+                    result = stage(result)
+                    timings.append((name, time.perf_counter() - start))
+                    if result is None:
+                        break
+            except Exception as e:
+                logger.warning("Pipeline stage failed", extra=fields(frame=seq, error=e, rate_limit=1))
+                result = None
+            if result is None:
+                self._discard(frame)
+
+            with self._lock:
+                for name, elapsed in timings:
+                    self._stage_busy[name] += elapsed
+                    self._stage_calls[name] += 1
+                if result is None:
+                    self._failed += 1
+                self._done[seq] = result
+                self._in_flight -= 1
+                self._frame_done.notify_all()
+
+    def stats(self):
+        """
+        Per-stage call counts, mean time and utilization of the worker pool,
+        plus frame counters for the whole pipeline.
+        """
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started_at, 1e-9)
+            capacity = elapsed * self.workers
+            stages = {}
+            for name, _ in self.stages:
+                calls = self._stage_calls[name]
+                busy = self._stage_busy[name]
+                stages[name] = {
+                    'calls': calls,
+                    'mean_ms': (busy / calls * 1000) if calls else 0.0,
+                    'utilization': busy / capacity,
+                }
+            return {
+                'workers': self.workers,
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self._in_flight,
+                'submitted': self._submitted,
+                'released': self._released,
+                'dropped': self._dropped,
+                'failed': self._failed,
+                'stages': stages,
+            }
+
+    def close(self):
+        """
+        Stop the workers. Frames still queued or not yet released are discarded.
+        """
+        with self._lock:
+            self._running = False
+            left_over = [frame for _, frame in self._pending]
+            self._pending.clear()
+            self._work_ready.notify_all()
+            self._frame_done.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        with self._lock:
+            left_over.extend(result for result in self._done.values() if result is not None)
+            self._done.clear()
+        for frame in left_over:
+            self._discard(frame)
+
+
+# Test: python pipeline.py
+if __name__ == "__main__":
+    import random
+
+    def slow_stage(frame):
+        time.sleep(random.uniform(0.005, 0.02))
+        return frame
+
+    pipeline = FramePipeline([('first', slow_stage), ('second', slow_stage)], workers=4, max_in_flight=8)
+    try:
+        released = []
+        for i in range(200):
+            pipeline.submit(i)
+            released.extend(pipeline.pop_ready())
+            time.sleep(0.002)
+        time.sleep(0.2)
+        released.extend(pipeline.pop_ready())
+
+        assert released == sorted(released), "Frames were released out of order"
+        print(f"Released {len(released)} of 200 frames in order")
+        print(pipeline.stats())
+    finally:
+        pipeline.close()
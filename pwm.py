@@ -0,0 +1,333 @@
+"""
+
+PWM backends for the motor enable pins.
+
+Example:
+from pwm import create_pwm_pair
+pwm_right, pwm_left = create_pwm_pair('auto', [12, 13], frequency=1000)
+pwm_right.start(0)
+pwm_right.set_duty(50)
+pwm_right.stop()
+
+Benchmark the backends available on this machine:
+python pwm.py bench --pins 12 13 --updates 2000
+
+"""
+
+import os
+import time
+import argparse
+
+from log import get_logger, fields, setup_logging
+
+logger = get_logger(__name__)
+
+# BCM pin -> hardware PWM channel on the Raspberry Pi. Pins on the same channel
+# always output the same duty cycle.
+HARDWARE_PWM_CHANNELS = {12: 0, 18: 0, 13: 1, 19: 1}
+
+
+class PWMBackend:
+    name = 'base'
+
+    def __init__(self, pin, frequency=1000):
+        """
+        One PWM output.
+
+        Parameters:
+        pin (int): BCM pin number.
+        frequency (int): PWM frequency in Hz.
+        """
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = 0
+
+    def start(self, duty=0):
+        self.set_duty(duty)
+
+    def set_duty(self, duty):
+        """
+        Set the duty cycle in percent (0-100).
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        self.set_duty(0)
+
+
+class RPiGPIOPWM(PWMBackend):
+    name = 'rpigpio'
+
+    def __init__(self, pin, frequency=1000):
+        """
+        Software PWM from RPi.GPIO. Works on any pin but runs a busy thread and
+        jitters when the CPU is loaded.
+        """
+        super().__init__(pin, frequency)
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin, GPIO.OUT)
+        self._pwm = GPIO.PWM(pin, frequency)
+
+    def start(self, duty=0):
+        self._pwm.start(duty)
+        self.duty = duty
+
+    def set_duty(self, duty):
+        self._pwm.ChangeDutyCycle(duty)
+        self.duty = duty
+
+    def stop(self):
+        self._pwm.stop()
+        self.duty = 0
+
+
+class PigpioPWM(PWMBackend):
+    name = 'pigpio'
+
+    def __init__(self, pin, frequency=1000):
+        """
+        Hardware PWM through the pigpio daemon (sudo pigpiod). Only on pins with
+        a hardware PWM channel.
+        """
+        super().__init__(pin, frequency)
+        if pin not in HARDWARE_PWM_CHANNELS:
+            raise ValueError(f"GPIO{pin} has no hardware PWM channel.")
+        import pigpio
+        self._pi = pigpio.pi()
+        if not self._pi.connected:
+            raise RuntimeError("pigpio daemon is not running.")
+
+    def set_duty(self, duty):
+        # pigpio takes duty in millionths
+        self._pi.hardware_PWM(self.pin, self.frequency, int(duty * 10000))
+        self.duty = duty
+
+    def stop(self):
+        self.set_duty(0)
+        self._pi.stop()
+
+
+class SysfsPWM(PWMBackend):
+    name = 'sysfs'
+
+    def __init__(self, pin, frequency=1000, chip='/sys/class/pwm/pwmchip0'):
+        """
+        Hardware PWM through the kernel driver. Needs the pwm-2chan overlay with
+        this pin routed to its channel, e.g. in /boot/config.txt:
+        dtoverlay=pwm-2chan,pin=12,func=4,pin2=13,func2=4
+        """
+        super().__init__(pin, frequency)
+        if pin not in HARDWARE_PWM_CHANNELS:
+            raise ValueError(f"GPIO{pin} has no hardware PWM channel.")
+        self.channel = HARDWARE_PWM_CHANNELS[pin]
+        self._path = os.path.join(chip, f'pwm{self.channel}')
+        if not os.path.exists(self._path):
+            self._write(os.path.join(chip, 'export'), self.channel)
+            # The channel directory can take a moment to appear with the right permissions
+            for _ in range(20):
+                if os.access(os.path.join(self._path, 'period'), os.W_OK):
+                    break
+                time.sleep(0.05)
+        self._period_ns = int(1e9 / frequency)
+        self._write(os.path.join(self._path, 'duty_cycle'), 0)
+        self._write(os.path.join(self._path, 'period'), self._period_ns)
+        self._duty_file = open(os.path.join(self._path, 'duty_cycle'), 'w')
+
+    @staticmethod
+    def _write(path, value):
+        with open(path, 'w') as f:
+            f.write(str(value))
+
+    def start(self, duty=0):
+        self.set_duty(duty)
+        self._write(os.path.join(self._path, 'enable'), 1)
+
+    def set_duty(self, duty):
+        # Keep the file open so an update is a single write
+        self._duty_file.seek(0)
+        self._duty_file.write(str(int(self._period_ns * duty / 100)))
+        self._duty_file.flush()
+        self.duty = duty
+
+    def stop(self):
+        self.set_duty(0)
+        self._write(os.path.join(self._path, 'enable'), 0)
+        self._duty_file.close()
+
+
+class MockPWM(PWMBackend):
+    name = 'mock'
+
+    def __init__(self, pin, frequency=1000):
+        """
+        Records every duty cycle change instead of driving a pin, for tests off the Pi.
+        """
+        super().__init__(pin, frequency)
+        self.history = []  # (time.monotonic(), duty)
+        self.running = False
+
+    def start(self, duty=0):
+        self.running = True
+        self.set_duty(duty)
+
+    def set_duty(self, duty):
+        self.duty = duty
+        self.history.append((time.monotonic(), duty))
+
+    def stop(self):
+        self.set_duty(0)
+        self.running = False
+
+
+BACKENDS = {backend.name: backend for backend in (PigpioPWM, SysfsPWM, RPiGPIOPWM, MockPWM)}
+HARDWARE_BACKENDS = ('pigpio', 'sysfs')
+
+
+def has_independent_hardware_pwm(pins):
+    """
+    True if every pin has a hardware PWM channel and no two pins share one.
+    """
+    channels = [HARDWARE_PWM_CHANNELS.get(pin) for pin in pins]
+    return None not in channels and len(set(channels)) == len(channels)
+
+
+def create_pwm_pair(backend, pins, frequency=1000):
+    """
+    Create one PWM output per pin with the same backend.
+
+    Parameters:
+    backend (str): 'pigpio', 'sysfs', 'rpigpio', 'mock' or 'auto'. 'auto' picks the
+                   first hardware backend that works for these pins and falls
+                   back to RPi.GPIO software PWM.
+    pins (list): BCM pins.
+    frequency (int): PWM frequency in Hz.
+    """
+    if backend != 'auto':
+        if backend in HARDWARE_BACKENDS and not has_independent_hardware_pwm(pins):
+            raise ValueError(f"Pins {pins} can't be driven independently by hardware PWM. "
+                             f"Use one pin from each channel: {HARDWARE_PWM_CHANNELS}.")
+        return [BACKENDS[backend](pin, frequency) for pin in pins]
+
+    if not has_independent_hardware_pwm(pins):
+        logger.warning("Enable pins can't use independent hardware PWM channels, using software PWM. "
+                       "Put one on GPIO12/18 and the other on GPIO13/19 to use hardware PWM.", extra=fields(pins=pins))
+    else:
+        for name in HARDWARE_BACKENDS:
+            outputs = []
+            try:
+                for pin in pins:
+                    outputs.append(BACKENDS[name](pin, frequency))
+                logger.info("Using hardware PWM", extra=fields(backend=name, pins=pins))
+                return outputs
+            except Exception as e:
+                for output in outputs:
+                    output.stop()
+                logger.info("PWM backend not available", extra=fields(backend=name, error=e))
+    return [RPiGPIOPWM(pin, frequency) for pin in pins]
+
+
+def system_cpu_times():
+    """
+    (busy, total) CPU time of the whole machine from /proc/stat, in clock ticks,
+    or None where it isn't available. Counts work done by daemons like pigpiod.
+    """
+    try:
+        with open('/proc/stat') as f:
+            values = [int(value) for value in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    idle = values[3] + (values[4] if len(values) > 4 else 0)  # idle + iowait
+    return sum(values) - idle, sum(values)
+
+
+def _system_cpu_percent(start, end):
+    # Percent of one core, like the process figures
+    if start is None or end is None or end[1] <= start[1]:
+        return None
+    return (end[0] - start[0]) / (end[1] - start[1]) * 100 * (os.cpu_count() or 1)
+
+
+def benchmark(backend, pins, frequency=1000, updates=2000, hold=2.0, update_rate=30):
+    """
+    Measure update latency of set_duty, and the CPU used while holding a duty
+    cycle and while updating it at joystick rate. CPU is measured for this
+    process and for the whole system; pigpio does its work in the pigpiod
+    daemon, so only the system figure compares backends fairly. Run it on an
+    otherwise idle machine.
+    """
+    outputs = create_pwm_pair(backend, pins, frequency)
+    try:
+        for output in outputs:
+            output.start(0)
+
+        latencies = []
+        for i in range(updates):
+            duty = (i * 7) % 101
+            for output in outputs:
+                start = time.perf_counter()
+                output.set_duty(duty)
+                latencies.append((time.perf_counter() - start) * 1e6)
+
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        system_start = system_cpu_times()
+        i = 0
+        while time.perf_counter() - wall_start < hold:
+            for output in outputs:
+                output.set_duty((i * 7) % 101)
+            i += 1
+            time.sleep(1.0 / update_rate)
+        updating_cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 100
+        updating_system_cpu = _system_cpu_percent(system_start, system_cpu_times())
+
+        for output in outputs:
+            output.set_duty(50)
+        cpu_start = time.process_time()
+        system_start = system_cpu_times()
+        time.sleep(hold)
+        holding_cpu = (time.process_time() - cpu_start) / hold * 100
+        holding_system_cpu = _system_cpu_percent(system_start, system_cpu_times())
+    finally:
+        for output in outputs:
+            output.stop()
+
+    latencies.sort()
+    return {
+        'backend': outputs[0].name,
+        'update_p50_us': latencies[len(latencies) // 2],
+        'update_p99_us': latencies[int(len(latencies) * 0.99)],
+        'updating_cpu_percent': updating_cpu,
+        'holding_cpu_percent': holding_cpu,
+        'updating_system_cpu_percent': updating_system_cpu,
+        'holding_system_cpu_percent': holding_system_cpu,
+    }
+
+
+if __name__ == "__main__":
+    setup_logging()
+    parser = argparse.ArgumentParser(description="PWM backend tools.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    bench = commands.add_parser('bench', help="Compare CPU use and update latency of the PWM backends")
+    bench.add_argument('--backends', nargs='+', default=['pigpio', 'sysfs', 'rpigpio', 'mock'])
+    bench.add_argument('--pins', nargs=2, type=int, default=[12, 13])
+    bench.add_argument('--frequency', type=int, default=1000)
+    bench.add_argument('--updates', type=int, default=2000)
+    bench.add_argument('--hold', type=float, default=2.0, help="Seconds to measure CPU in each phase")
+    bench.add_argument('--update-rate', type=float, default=30, help="Duty updates per second while measuring CPU")
+    args = parser.parse_args()
+
+    # "system" columns include daemons such as pigpiod, in percent of one core
+    print(f"{'backend':<10} {'p50 us':>8} {'p99 us':>8} {'cpu updating':>13} {'cpu holding':>12} "
+          f"{'system updating':>16} {'system holding':>15}")
+    for name in args.backends:
+        try:
+            result = benchmark(name, args.pins, args.frequency, args.updates, args.hold, args.update_rate)
+        except Exception as e:
+            print(f"{name:<10} not available: {e}")
+            continue
+        system = [f"{value:>.1f}%" if value is not None else '-'
+                  for value in (result['updating_system_cpu_percent'], result['holding_system_cpu_percent'])]
+        print(f"{name:<10} {result['update_p50_us']:>8.1f} {result['update_p99_us']:>8.1f} "
+              f"{result['updating_cpu_percent']:>12.1f}% {result['holding_cpu_percent']:>11.1f}% "
+              f"{system[0]:>16} {system[1]:>15}")
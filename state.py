@@ -0,0 +1,65 @@
+"""
+
+Example:
+from state import StateStore
+state = StateStore(stream_on=False, motors_on=True)
+state.snapshot()                # {'version': 0, 'state': {'stream_on': False, 'motors_on': True}}
+state.update(stream_on=True)    # {'version': 1, 'changes': {'stream_on': True}}
+state.update(stream_on=True)    # None, nothing changed
+
+"""
+
+import threading
+
+
+class StateStore:
+    def __init__(self, **initial):
+        """
+        Holds the rover state shared with the web clients, with a version number
+        that goes up by one on every change.
+
+        New clients get a full snapshot once; after that only deltas are sent,
+        each tagged with the version it produces so a client that missed one can
+        ask for a fresh snapshot.
+
+        Parameters:
+        **initial: Field names and their starting values.
+        """
+        self._lock = threading.Lock()
+        self._values = dict(initial)
+        self.version = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._values.get(key, default)
+
+    def snapshot(self):
+        """
+        Return every field together with the current version.
+        """
+        with self._lock:
+            return {'version': self.version, 'state': dict(self._values)}
+
+    def update(self, **changes):
+        """
+        Apply the changes and return the resulting delta, or None when no value
+        actually changed (so callers have nothing to send).
+        """
+        with self._lock:
+            changed = {key: value for key, value in changes.items()
+                       if key not in self._values or self._values[key] != value}
+            if not changed:
+                return None
+            self._values.update(changed)
+            self.version += 1
+            return {'version': self.version, 'changes': changed}
+
+
+# Test: python state.py
+if __name__ == "__main__":
+    state = StateStore(stream_on=False, motors_on=True, lights_on=False)
+    print(state.snapshot())
+    print(state.update(stream_on=True))
+    print(state.update(stream_on=True, motors_on=True))
+    print(state.update(speed_limit=60))
+    print(state.snapshot())
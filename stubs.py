@@ -0,0 +1,170 @@
+"""
+
+Stand-ins for the rover hardware so the server can run off the Pi (load tests, development).
+
+Example:
+from stubs import install_fake_gpio, StubCamera
+install_fake_gpio()            # before importing motor or webserver
+from motor import MotorDriver
+camera = StubCamera(width=960, height=540, fps=30)
+
+"""
+
+import os
+import sys
+import time
+import types
+import threading
+import cv2
+import numpy as np
+
+from camera import CameraHandler
+from bufferpool import frame_pool
+
+
+def install_fake_gpio():
+    """
+    Register a do-nothing RPi.GPIO module so `import RPi.GPIO as GPIO` works off the Pi.
+    Returns the fake module.
+    """
+    if 'RPi.GPIO' in sys.modules and getattr(sys.modules['RPi.GPIO'], 'IS_FAKE', False):
+        return sys.modules['RPi.GPIO']
+
+    gpio = types.ModuleType('RPi.GPIO')
+    gpio.IS_FAKE = True
+    gpio.BCM = 11
+    gpio.OUT = 0
+    gpio.IN = 1
+    gpio.HIGH = 1
+    gpio.LOW = 0
+    gpio.pin_states = {}
+
+    def output(pin, value):
+        gpio.pin_states[pin] = value
+
+    class PWM:
+        def __init__(self, pin, frequency):
+            self.pin = pin
+            self.frequency = frequency
+            self.duty_cycle = 0
+
+        def start(self, duty_cycle):
+            self.duty_cycle = duty_cycle
+
+        def ChangeDutyCycle(self, duty_cycle):
+            self.duty_cycle = duty_cycle
+
+        def ChangeFrequency(self, frequency):
+            self.frequency = frequency
+
+        def stop(self):
+            self.duty_cycle = 0
+
+    gpio.setmode = lambda mode: None
+    gpio.setwarnings = lambda flag: None
+    gpio.setup = lambda pin, mode, **kwargs: None
+    gpio.output = output
+    gpio.cleanup = lambda *pins: gpio.pin_states.clear()
+    gpio.PWM = PWM
+
+    package = sys.modules.get('RPi') or types.ModuleType('RPi')
+    package.GPIO = gpio
+    sys.modules['RPi'] = package
+    sys.modules['RPi.GPIO'] = gpio
+    return gpio
+
+
+class StubCamera(CameraHandler):
+    def __init__(self, width=960, height=540, fps=30, frames=30):
+        """
+        Serves pre-encoded synthetic JPEG frames at the requested frame rate,
+        the same way libcamera-vid hands them to CameraHandler on Linux.
+
+        Parameters:
+        width (int), height (int), fps (int): Frame size and rate.
+        frames (int): Number of distinct frames generated and played in a loop.
+        """
+        self.system = "Stub"
+        self.source = 'stub'
+        self.camera_index = 0
+        self.cap = None
+        self.process = None
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.captured_at = None
+
+        self._frames = []
+        for i in range(frames):
+            image = np.full((height, width, 3), 40, dtype=np.uint8)
+            x = int((width - 100) * i / max(frames - 1, 1))
+            cv2.rectangle(image, (x, height // 3), (x + 100, height // 3 + 100), (0, 200, 0), -1)
+            cv2.putText(image, f"stub {i}", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+            self._frames.append(cv2.imencode('.jpg', image)[1].tobytes())
+
+        self._lock = threading.Lock()
+        self._index = 0
+        self._next_frame_at = time.monotonic()
+
+    def get_frame(self):
+        # Pace all readers together like a real sensor would
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_frame_at - now
+            self._next_frame_at = max(self._next_frame_at, now) + 1.0 / self.fps
+            frame = self._frames[self._index % len(self._frames)]
+            self._index += 1
+        if wait > 0:
+            time.sleep(wait)
+        self.captured_at = time.monotonic()
+        # Copied into a pooled buffer like a frame read from the libcamera-vid pipe
+        return frame_pool.get_buffer(len(frame)).write(frame)
+
+    def get_still(self):
+        frame = self.get_frame()
+        image = self.decode_frame(frame)
+        frame.release()
+        return image
+
+    def shut_down(self):
+        pass
+
+
+class StubRunner:
+    def __init__(self, model_path=None, delay=0.05, crash_every=None):
+        """
+        Stand-in for edge_impulse_linux's ImageImpulseRunner with the same calls.
+        Takes `delay` seconds per classification and reports one box that moves
+        across the frame.
+
+        Parameters:
+        model_path (str): Ignored, accepted so it can replace ImageImpulseRunner(model_path).
+        delay (float): Seconds spent in classify.
+        crash_every (int): Exit the process after this many classifications, to test restarts.
+        """
+        self.model_path = model_path
+        self.delay = delay
+        self.crash_every = crash_every
+        self._count = 0
+
+    def init(self):
+        return {'model_parameters': {'image_input_width': 320, 'image_input_height': 320}}
+
+    def get_features_from_image(self, image):
+        # Square crop resized to the model input, like the real runner
+        size = min(image.shape[:2])
+        cropped = cv2.resize(image[:size, :size], (320, 320))
+        return cropped, cropped
+
+    def classify(self, features):
+        time.sleep(self.delay)
+        self._count += 1
+        if self.crash_every and self._count % self.crash_every == 0:
+            os._exit(1)
+        x = (self._count * 7) % 300
+        return {'result': {'bounding_boxes': [
+            {'label': 'cat_face', 'value': 0.8, 'x': x, 'y': 150, 'width': 20, 'height': 20},
+        ]}}
+
+    def stop(self):
+        pass
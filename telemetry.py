@@ -0,0 +1,254 @@
+"""
+
+Example:
+from telemetry import Telemetry, cpu_temperature
+telemetry = Telemetry({'cpu_temp': cpu_temperature}, rate_hz=2)
+telemetry.start()
+batch = telemetry.since(0)                     # every sample still held
+history = telemetry.history(start=time.time() - 60, end=time.time(), points=60)
+telemetry.stop()
+
+"""
+
+import math
+import time
+import threading
+import numpy as np
+
+from log import get_logger, fields
+
+logger = get_logger(__name__)
+
+# Upper bound on history buckets, so a request can't size arrays at will
+MAX_HISTORY_POINTS = 1000
+
+
+def cpu_temperature():
+    """
+    CPU temperature in degrees Celsius, or None if the board doesn't expose it.
+    """
+    try:
+        with open('/sys/class/thermal/thermal_zone0/temp') as f:
+            return int(f.read().strip()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+def wifi_link_quality(interface='wlan0'):
+    """
+    Wi-Fi link quality as reported in /proc/net/wireless (0-70 on the Pi), or None.
+    """
+    try:
+        with open('/proc/net/wireless') as f:
+            for line in f:
+                if line.strip().startswith(interface + ':'):
+                    return float(line.split()[2].rstrip('.'))
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class RateCounter:
+    def __init__(self):
+        """
+        Counts events (e.g. frames sent) and turns them into a rate each time it is sampled.
+        """
+        self._lock = threading.Lock()
+        self._count = 0
+        self._last_count = 0
+        self._last_time = time.monotonic()
+
+    def add(self, n=1):
+        with self._lock:
+            self._count += n
+
+    def rate(self):
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_time
+            rate = (self._count - self._last_count) / elapsed if elapsed > 0 else 0.0
+            self._last_count = self._count
+            self._last_time = now
+            return rate
+
+
+class RingBuffer:
+    def __init__(self, fields, capacity):
+        """
+        Fixed size, preallocated time series storage. Samples are written in place
+        and the oldest ones are overwritten once the buffer is full.
+
+        Parameters:
+        fields (list): Names of the values stored with each sample.
+        capacity (int): Number of samples kept.
+        """
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.full((capacity, len(self.fields)), np.nan, dtype=np.float32)
+        self.count = 0  # total samples ever written
+
+    def append(self, timestamp, values):
+        index = self.count % self.capacity
+        self.times[index] = timestamp
+        self.values[index] = values
+        self.count += 1
+
+    def since(self, count):
+        """
+        Return (times, values, count) for the samples written after `count`
+        samples, oldest first. Samples that were already overwritten are skipped.
+        """
+        first = max(count, self.count - self.capacity)
+        if first >= self.count:
+            return self.times[:0], self.values[:0], self.count
+        indexes = np.arange(first, self.count) % self.capacity
+        return self.times[indexes], self.values[indexes], self.count
+
+
+def _to_json_list(array):
+    # NaN is not valid JSON, missing readings are sent as null
+    return [None if math.isnan(value) else round(float(value), 3) for value in array]
+
+
+class Telemetry:
+    def __init__(self, sources, rate_hz=2, memory_budget=1_000_000):
+        """
+        Samples a set of readings at a fixed rate into a ring buffer that never
+        grows past the memory budget.
+
+        Parameters:
+        sources (dict): Field name -> callable returning a number or None.
+        rate_hz (float): Sampling rate.
+        memory_budget (int): Bytes available for samples. Sets how much history is kept.
+        """
+        self.sources = dict(sources)
+        self.rate_hz = rate_hz
+        bytes_per_sample = 8 + 4 * len(self.sources)
+        self.buffer = RingBuffer(self.sources.keys(), max(1, memory_budget // bytes_per_sample))
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def fields(self):
+        return self.buffer.fields
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def sample(self):
+        """
+        Read every source once and store the result.
+        """
+        values = []
+        for name, source in self.sources.items():
+            try:
+                value = source()
+            except Exception as e:
+                logger.warning("Telemetry source failed", extra=fields(source=name, error=e, rate_limit=0.1))
+                value = None
+            values.append(np.nan if value is None else value)
+        with self._lock:
+            self.buffer.append(time.time(), values)
+
+    def _run(self):
+        interval = 1.0 / self.rate_hz
+        next_sample = time.monotonic()
+        while not self._stop.is_set():
+            self.sample()
+            next_sample += interval
+            # Don't try to catch up if sampling fell behind
+            next_sample = max(next_sample, time.monotonic())
+            self._stop.wait(next_sample - time.monotonic())
+
+    def since(self, count):
+        """
+        Samples written after `count`, as a JSON friendly batch. Pass the returned
+        'count' on the next call to get only new samples.
+        """
+        with self._lock:
+            times, values, count = self.buffer.since(count)
+        return {
+            'count': count,
+            't': [round(float(t), 3) for t in times],
+            'values': {field: _to_json_list(values[:, i]) for i, field in enumerate(self.fields)},
+        }
+
+    def history(self, start, end, points=100, fields=None):
+        """
+        Downsample the samples between start and end (unix time) into `points`
+        equal time buckets, with min/max/mean per bucket and field. Buckets
+        without samples are null.
+        """
+        fields = [field for field in (fields or self.fields) if field in self.fields]
+        points = min(max(1, int(points)), MAX_HISTORY_POINTS)
+        with self._lock:
+            times, values, _ = self.buffer.since(0)
+
+        in_window = (times >= start) & (times <= end)
+        times = times[in_window]
+        values = values[in_window]
+
+        span = max(end - start, 1e-9)
+        bucket = np.minimum(((times - start) / span * points).astype(np.int64), points - 1)
+        centers = start + (np.arange(points) + 0.5) * span / points
+
+        series = {}
+        for field in fields:
+            column = values[:, self.fields.index(field)].astype(np.float64)
+            valid = ~np.isnan(column)
+            field_bucket = bucket[valid]
+            column = column[valid]
+
+            counts = np.bincount(field_bucket, minlength=points)
+            sums = np.bincount(field_bucket, weights=column, minlength=points)
+            minimum = np.full(points, np.inf)
+            maximum = np.full(points, -np.inf)
+            np.minimum.at(minimum, field_bucket, column)
+            np.maximum.at(maximum, field_bucket, column)
+
+            empty = counts == 0
+            mean = np.divide(sums, counts, out=np.full(points, np.nan), where=~empty)
+            minimum[empty] = np.nan
+            maximum[empty] = np.nan
+            series[field] = {
+                'min': _to_json_list(minimum),
+                'max': _to_json_list(maximum),
+                'mean': _to_json_list(mean),
+            }
+
+        return {'t': [round(float(t), 3) for t in centers], 'series': series}
+
+
+# Test: python telemetry.py
+if __name__ == "__main__":
+    import random
+
+    telemetry = Telemetry({
+        'cpu_temp': cpu_temperature,
+        'link_quality': wifi_link_quality,
+        'noise': lambda: random.random(),
+    }, rate_hz=50, memory_budget=2_000)
+    print(f"Ring buffer holds {telemetry.buffer.capacity} samples")
+
+    telemetry.start()
+    time.sleep(1)
+    telemetry.stop()
+
+    batch = telemetry.since(0)
+    print(f"Samples held: {len(batch['t'])}, total taken: {batch['count']}")
+    now = time.time()
+    history = telemetry.history(now - 1, now, points=5)
+    print(history['series']['noise'])
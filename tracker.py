@@ -0,0 +1,190 @@
+"""
+
+Example:
+from tracker import BoxTracker
+tracker = BoxTracker()
+tracker.update(result["result"]["bounding_boxes"], time.monotonic())   # when a detection arrives
+boxes = tracker.predict(time.monotonic())                             # on every frame
+image = cam.draw_bounding_boxes(image, boxes)
+
+"""
+
+import threading
+import numpy as np
+
+
+def iou_matrix(a, b):
+    """
+    Intersection over union of every box in `a` against every box in `b`.
+    Boxes are (x, y, width, height) rows with x, y the top left corner.
+    """
+    ax1, ay1 = a[:, 0:1], a[:, 1:2]
+    ax2, ay2 = ax1 + a[:, 2:3], ay1 + a[:, 3:4]
+    bx1, by1 = b[:, 0], b[:, 1]
+    bx2, by2 = bx1 + b[:, 2], by1 + b[:, 3]
+
+    inter_w = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None)
+    inter_h = np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None)
+    intersection = inter_w * inter_h
+    union = (a[:, 2:3] * a[:, 3:4]) + (b[:, 2] * b[:, 3]) - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+def _greedy_match(score, threshold):
+    # Best pairs first; each track and detection used once
+    matches = []
+    if score.size == 0:
+        return matches
+    order = np.argsort(-score, axis=None)
+    rows, cols = np.unravel_index(order, score.shape)
+    used_rows, used_cols = set(), set()
+    for row, col in zip(rows, cols):
+        if score[row, col] < threshold:
+            break
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matches.append((row, col))
+    return matches
+
+
+class BoxTracker:
+    def __init__(self, iou_threshold=0.2, max_distance=40, max_age=1.0, max_predict=0.5, smoothing=0.5):
+        """
+        Keeps detections alive between inferences. Detections are matched to
+        existing tracks by IoU, then by centroid distance for boxes that moved
+        too far to overlap, so each object keeps a stable track_id. Between
+        inferences every track moves along its estimated velocity.
+
+        Parameters:
+        iou_threshold (float): Minimum IoU for a detection to continue a track.
+        max_distance (float): Maximum centroid distance (in box coordinates) for the fallback match.
+        max_age (float): Seconds a track is kept without a matching detection.
+        max_predict (float): Seconds a track is extrapolated past its last detection before it holds still.
+        smoothing (float): Weight of the newest velocity measurement (0-1).
+        """
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_age = max_age
+        self.max_predict = max_predict
+        self.smoothing = smoothing
+
+        self._lock = threading.Lock()
+        self._boxes = np.zeros((0, 4))       # x, y, width, height at the last detection
+        self._velocity = np.zeros((0, 2))    # x, y per second
+        self._updated_at = np.zeros(0)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._labels = []
+        self._values = []
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _positions(self, timestamp):
+        dt = np.clip(timestamp - self._updated_at, 0, self.max_predict)
+        boxes = self._boxes.copy()
+        boxes[:, :2] += self._velocity * dt[:, None]
+        return boxes
+
+    def update(self, bounding_boxes, timestamp):
+        """
+        Feed a new set of detections (dicts with x, y, width, height, label, value)
+        taken at `timestamp` (time.monotonic()).
+        """
+        detections = np.array([[float(bb['x']), float(bb['y']), float(bb['width']), float(bb['height'])]
+                               for bb in bounding_boxes]).reshape(-1, 4)
+        labels = [bb.get('label') for bb in bounding_boxes]
+        values = [bb.get('value', 0.0) for bb in bounding_boxes]
+
+        with self._lock:
+            predicted = self._positions(timestamp)
+            same_label = np.array([[track_label == label for label in labels] for track_label in self._labels],
+                                  dtype=bool).reshape(len(self._labels), len(labels))
+
+            # First pass: overlap
+            score = iou_matrix(predicted, detections) * same_label
+            matches = _greedy_match(score, self.iou_threshold)
+
+            # Second pass: centroid distance for what is left
+            matched_tracks = {row for row, _ in matches}
+            matched_detections = {col for _, col in matches}
+            free_tracks = np.array([i for i in range(len(predicted)) if i not in matched_tracks], dtype=np.int64)
+            free_detections = np.array([j for j in range(len(detections)) if j not in matched_detections], dtype=np.int64)
+            if len(free_tracks) and len(free_detections):
+                track_centers = predicted[free_tracks, :2] + predicted[free_tracks, 2:] / 2
+                detection_centers = detections[free_detections, :2] + detections[free_detections, 2:] / 2
+                distance = np.linalg.norm(track_centers[:, None, :] - detection_centers[None, :, :], axis=2)
+                closeness = (1 - distance / self.max_distance) * same_label[np.ix_(free_tracks, free_detections)]
+                for row, col in _greedy_match(closeness, 1e-9):
+                    matches.append((free_tracks[row], free_detections[col]))
+
+            # Matched tracks: new velocity from the last detected position
+            for row, col in matches:
+                dt = timestamp - self._updated_at[row]
+                if dt > 0:
+                    measured = (detections[col, :2] - self._boxes[row, :2]) / dt
+                    self._velocity[row] = self.smoothing * measured + (1 - self.smoothing) * self._velocity[row]
+                self._boxes[row] = detections[col]
+                self._updated_at[row] = timestamp
+                self._values[row] = values[col]
+
+            # Unmatched detections start new tracks
+            matched_detections = {col for _, col in matches}
+            new = [j for j in range(len(detections)) if j not in matched_detections]
+            if new:
+                self._boxes = np.vstack([self._boxes, detections[new]])
+                self._velocity = np.vstack([self._velocity, np.zeros((len(new), 2))])
+                self._updated_at = np.concatenate([self._updated_at, np.full(len(new), timestamp)])
+                self._ids = np.concatenate([self._ids, np.arange(self._next_id, self._next_id + len(new))])
+                self._labels.extend(labels[j] for j in new)
+                self._values.extend(values[j] for j in new)
+                self._next_id += len(new)
+
+            self._expire(timestamp)
+
+    def _expire(self, timestamp):
+        keep = (timestamp - self._updated_at) <= self.max_age
+        if keep.all():
+            return
+        self._boxes = self._boxes[keep]
+        self._velocity = self._velocity[keep]
+        self._updated_at = self._updated_at[keep]
+        self._ids = self._ids[keep]
+        self._labels = [label for label, k in zip(self._labels, keep) if k]
+        self._values = [value for value, k in zip(self._values, keep) if k]
+
+    def predict(self, timestamp):
+        """
+        Where every live track is expected to be at `timestamp`, in the same
+        format as the detections plus a 'track_id'.
+        """
+        with self._lock:
+            self._expire(timestamp)
+            boxes = self._positions(timestamp)
+            return [
+                {'x': box[0], 'y': box[1], 'width': box[2], 'height': box[3],
+                 'label': label, 'value': value, 'track_id': int(track_id)}
+                for box, label, value, track_id in zip(boxes, self._labels, self._values, self._ids)
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._expire(float('inf'))
+
+
+# Test: python tracker.py
+if __name__ == "__main__":
+    tracker = BoxTracker()
+    # A cat moving right at 100 units/s, detected every 0.25s
+    for step in range(4):
+        t = step * 0.25
+        tracker.update([{'x': 100 + 100 * t, 'y': 50, 'width': 30, 'height': 30, 'label': 'cat_face', 'value': 0.8}], t)
+        print(f"t={t:.2f} detected x={100 + 100 * t:.1f}")
+
+    for t in (0.8, 0.875, 0.95):
+        box = tracker.predict(t)[0]
+        print(f"t={t:.3f} predicted x={box['x']:.1f} (expected {100 + 100 * t:.1f}), track {box['track_id']}")
+
+    print(f"Tracks after 2s without detections: {len(tracker.predict(2.0))}")
@@ -1,23 +1,82 @@
+import os
+import math
 import cv2
+import hmac
 import time
+import itertools
+import threading
 import RPi.GPIO as GPIO
 from flask_socketio import SocketIO
-from flask import Flask, render_template, Response
+from flask import Flask, render_template, Response, jsonify, request
 
 
 from motor import MotorDriver
 from camera import CameraHandler
+from camera_registry import CameraRegistry, ReconfigureBusy, validate_settings
+from camera_stream import CameraStream
+from state import StateStore
+from tracker import BoxTracker
+from profiler import SamplingProfiler, ProfilerBusy
+from telemetry import Telemetry, RateCounter, cpu_temperature, wifi_link_quality, MAX_HISTORY_POINTS
+from latency import FrameLatency
+from bufferpool import frame_pool, memory_stats
+from log import get_logger, fields, setup_logging, set_level, get_level, LEVELS
+
+logger = get_logger(__name__)
 
 class RoverWebServer:
-    def __init__(self, motor_driver, camera_handler, led_pin=25):
+    def __init__(self, motor_driver, cameras, led_pin=25, admin_token=None):
+        """
+        Parameters:
+        motor_driver (MotorDriver): Drives the wheels.
+        cameras (CameraRegistry or CameraHandler): Cameras to stream. A single
+                                                   CameraHandler is registered as 'default'.
+        led_pin (int): GPIO pin for the rover lights.
+        admin_token (str): Token for admin commands. Defaults to $ROVER_ADMIN_TOKEN.
+        """
         self.app = Flask(__name__)
         self.socketio = SocketIO(self.app)
-        self.camera_handler = camera_handler
+        if not isinstance(cameras, CameraRegistry):
+            camera_handler = cameras
+            cameras = CameraRegistry()
+            cameras.add_handler('default', camera_handler)
+        self.cameras = cameras
         self.motor_driver = motor_driver
-        # Default states
-        self.stream_on = False
-        self.motors_on = True  
-        self.lights_on = False 
+        # Default states, shared with the web clients
+        self.state = StateStore(stream_on=False, motors_on=True, lights_on=False,
+                                cameras=self.cameras.running(), camera_settings=self.cameras.settings(),
+                                log_level=get_level())
+        # Detections drawn on each camera's stream, tracked so they follow targets between
+        # detections. No live tracks means frames are passed through untouched.
+        self.trackers = {}
+        # Decode, overlay and encode once per camera for all viewers
+        self.streams = {}
+        self._streams_lock = threading.Lock()
+        # Per-hop and capture-to-display latency of the frames sent to the page
+        self.latency = FrameLatency()
+        self._stream_ids = itertools.count()
+
+        # Telemetry sampled in the background, pushed to subscribed clients. fps is the
+        # main camera's capture rate; frames_sent_per_s adds up every open stream.
+        self.frames_sent = RateCounter()
+        sources = {
+            'left_duty': lambda: getattr(self.motor_driver, 'left_duty', None),
+            'right_duty': lambda: getattr(self.motor_driver, 'right_duty', None),
+            'cpu_temp': cpu_temperature,
+            'frames_sent_per_s': self.frames_sent.rate,
+            'link_quality': wifi_link_quality,
+            'rss_mb': lambda: memory_stats()['rss_mb'],
+            'pool_allocs': frame_pool.allocation_rate.rate,
+        }
+        for camera_id, worker in self.cameras.workers.items():
+            sources['fps' if camera_id == self.cameras.default_id else f'fps_{camera_id}'] = worker.fps
+        self.telemetry = Telemetry(sources, rate_hz=2)
+        self._telemetry_clients = {}  # sid -> {'interval', 'next_push', 'count'}
+        self._telemetry_lock = threading.Lock()
+
+        # Admin commands (profiling) are disabled unless a token is configured
+        self.admin_token = admin_token or os.environ.get('ROVER_ADMIN_TOKEN')
+        self.profiler = SamplingProfiler()
         self._setup_routes()
 
         # Servos
@@ -33,92 +92,402 @@ class RoverWebServer:
             return render_template('index.html')
 
         @self.app.route('/video_feed')
-        def video_feed():
-            if self.stream_on:
-                return Response(self.generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+        @self.app.route('/video_feed/<camera_id>')
+        def video_feed(camera_id=None):
+            if camera_id is not None and camera_id not in self.cameras.workers:
+                return Response(status=404)
+            if self.stream_on and self.cameras.get(camera_id).running:
+                return Response(self.generate_frames(camera_id), mimetype='multipart/x-mixed-replace; boundary=frame')
             else:
                 return Response(status=204)  # No Content
 
+        @self.app.route('/cameras')
+        def cameras():
+            return jsonify(self.cameras.stats())
+
+        @self.app.route('/cameras/<camera_id>/config', methods=['GET', 'POST'])
+        def camera_config(camera_id):
+            # e.g. curl -X POST -H 'Content-Type: application/json' -d '{"width": 640, "height": 360, "fps": 15}' \
+            #      http://raspberrypi.local:5001/cameras/front/config
+            if camera_id not in self.cameras.workers:
+                return Response(status=404)
+            worker = self.cameras.get(camera_id)
+            if request.method == 'GET':
+                return jsonify(worker.settings())
+            try:
+                switch = self._reconfigure_camera(camera_id, request.get_json(silent=True) or {})
+            except ReconfigureBusy as e:
+                return jsonify({'error': str(e)}), 409
+            except (ValueError, TypeError) as e:
+                return jsonify({'error': str(e)}), 400
+            if not self._wait_camera_switch(switch):
+                return jsonify({'status': 'pending'}), 202
+            self._camera_switched()
+            return jsonify(switch.result)
+
+        @self.app.route('/stats/pipeline')
+        def pipeline_stats():
+            return jsonify([stream.stats() for stream in list(self.streams.values())])
+
+        @self.app.route('/stats/memory')
+        def memory_stats_route():
+            # Frame buffer pool and process memory; pool allocations should stay flat once streams are running
+            return jsonify({'pool': frame_pool.stats(), **memory_stats()})
+
+        @self.app.route('/stats/latency')
+        def latency_stats():
+            # Milliseconds per hop, e.g. /stats/latency?buckets=1 for the full histograms
+            return jsonify(self.latency.stats(buckets=request.args.get('buckets', 0, type=int) == 1))
+
+        @self.app.route('/telemetry/history')
+        def telemetry_history():
+            # e.g. /telemetry/history?fields=cpu_temp,fps&start=1700000000&end=1700000600&points=120
+            end = request.args.get('end', time.time(), type=float)
+            start = request.args.get('start', end - 60, type=float)
+            points = request.args.get('points', 100, type=int)
+            if not 1 <= points <= MAX_HISTORY_POINTS:
+                return jsonify({'error': f"points must be between 1 and {MAX_HISTORY_POINTS}"}), 400
+            fields = request.args.get('fields')
+            fields = fields.split(',') if fields else None
+            return jsonify(self.telemetry.history(start, end, points=points, fields=fields))
+
+        @self.app.route('/admin/profile')
+        def admin_profile():
+            # e.g. curl -H 'X-Admin-Token: ...' 'http://raspberrypi.local:5001/admin/profile?seconds=10&format=collapsed'
+            if not self._is_admin(request.headers.get('X-Admin-Token', request.args.get('token'))):
+                return Response(status=403)
+            try:
+                seconds = self._profile_seconds(request.args.get('seconds', 5))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            try:
+                result = self.profiler.run(seconds)
+            except ProfilerBusy as e:
+                return jsonify({'error': str(e)}), 409
+            if request.args.get('format') == 'collapsed':
+                return Response(result['collapsed'], mimetype='text/plain')
+            return jsonify(result)
+
+        @self.socketio.on('start_profile')
+        def handle_start_profile(data):
+            if not self._is_admin(data.get('token')):
+                self.socketio.emit('profile_result', {'error': 'unauthorized'}, to=request.sid)
+                return
+            try:
+                seconds = self._profile_seconds(data.get('seconds', 5))
+            except ValueError as e:
+                self.socketio.emit('profile_result', {'error': str(e)}, to=request.sid)
+                return
+            # Run in the background so this handler doesn't hold up other events
+            self.socketio.start_background_task(self._run_profile, request.sid, seconds)
+
+        @self.socketio.on('telemetry_subscribe')
+        def handle_telemetry_subscribe(data):
+            # Client picks how often it wants batches, capped by the sampling rate
+            rate_hz = min(max(float(data.get('rate_hz', 1)), 0.1), self.telemetry.rate_hz)
+            with self._telemetry_lock:
+                self._telemetry_clients[request.sid] = {
+                    'interval': 1.0 / rate_hz,
+                    'next_push': time.monotonic(),
+                    'count': self.telemetry.buffer.count,
+                }
+
+        @self.socketio.on('telemetry_unsubscribe')
+        def handle_telemetry_unsubscribe():
+            with self._telemetry_lock:
+                self._telemetry_clients.pop(request.sid, None)
+
+        @self.socketio.on('disconnect')
+        def handle_disconnect():
+            with self._telemetry_lock:
+                self._telemetry_clients.pop(request.sid, None)
+
+        @self.socketio.on('latency_ping')
+        def handle_latency_ping():
+            # The page times the ack to estimate how long its reports take to arrive
+            return {}
+
+        @self.socketio.on('frame_displayed')
+        def handle_frame_displayed(data):
+            try:
+                stream_id, seq = int(data['stream_id']), int(data['seq'])
+                display_ms = float(data['display_ms'])
+                rtt_ms = float(data['rtt_ms']) if data.get('rtt_ms') is not None else None
+            except (KeyError, TypeError, ValueError):
+                return
+            # float() takes 'nan' and 'inf', which would poison the histograms
+            if not math.isfinite(display_ms) or (rtt_ms is not None and not math.isfinite(rtt_ms)):
+                return
+            self.latency.frame_displayed(stream_id, seq, display_ms, rtt_ms)
+
         @self.socketio.on('joystick_move')
         def handle_joystick_move(data):
             coordinates = data.get('coordinates', (0, 0))
             forward, rightward = coordinates
-            # if either of the coordinates is less than 15% then set it to zero
-            forward = 0 if (-20 <= forward <= 20) else forward
-            rightward = 0 if (-15 <= rightward <= 15) else rightward
-        
-            print(f"JOYSTICK: forward {forward}%, rightward {rightward}%")
-    
+            logger.debug("Joystick", extra=fields(forward=forward, rightward=rightward, rate_limit=2))
+
+            # Deadbands are part of the mixing profile, (0, 0) stops the motors
             if self.motors_on:
-                if (forward==0) & (rightward==0):
-                    self.motor_driver.stop()
-                else:
-                    self.motor_driver.move(forward, rightward)
+                self.motor_driver.move(forward, rightward)
+
+        @self.socketio.on('load_mix_profile')
+        def handle_load_mix_profile(data):
+            # Admin only: hot-swap the motor calibration, from a profile dict or by re-reading the file
+            if not self._is_admin(data.get('token')):
+                return {'error': 'unauthorized'}
+            try:
+                self.motor_driver.load_profile(data.get('profile') or self.motor_driver.profile_path)
+            except (OSError, ValueError, TypeError) as e:
+                return {'error': str(e)}
+            return {'profile': self.motor_driver.mixer.profile.to_dict()}
+
+        @self.socketio.on('camera_start')
+        def handle_camera_start(data):
+            camera_id = data.get('camera_id')
+            if camera_id in self.cameras.workers:
+                self.cameras.start(camera_id)
+                self.update_state(cameras=self.cameras.running())
+
+        @self.socketio.on('camera_stop')
+        def handle_camera_stop(data):
+            camera_id = data.get('camera_id')
+            if camera_id in self.cameras.workers:
+                self.cameras.stop(camera_id)
+                self.update_state(cameras=self.cameras.running())
+
+        @self.socketio.on('camera_configure')
+        def handle_camera_configure(data):
+            # Quality picker on the page: new resolution / fps, streams keep running
+            camera_id = data.get('camera_id') or self.cameras.default_id
+            settings = {key: data[key] for key in ('width', 'height', 'fps') if key in data}
+            try:
+                if camera_id not in self.cameras.workers:
+                    raise ValueError(f"Unknown camera {camera_id}.")
+                switch = self._reconfigure_camera(camera_id, settings)
+            except (ReconfigureBusy, ValueError, TypeError) as e:
+                self.socketio.emit('camera_config_result', {'camera_id': camera_id, 'error': str(e)}, to=request.sid)
+                return
+            # Opening the camera takes a while; wait in the background so this handler doesn't hold up other events
+            self.socketio.start_background_task(self._report_camera_switch, request.sid, camera_id, switch)
+
+        @self.socketio.on('set_log_level')
+        def handle_set_log_level(data):
+            # Log level picker on the page, applies to every module
+            level = str(data.get('level', '')).upper()
+            if level not in LEVELS:
+                return
+            set_level(level)
+            logger.info("Log level changed", extra=fields(level=level))
+            self.update_state(log_level=level)
 
         @self.socketio.on('connect')
         def handle_connect():
-            # Emit the current stream state to the client upon connection or refresh
-            self.socketio.emit('stream_state', {'status': self.stream_on})
-            self.socketio.emit('motors_state', {'status': self.motors_on})
-            self.socketio.emit('light_state', {'status': self.lights_on})
+            # Only the new client needs the full state; everyone else is already in sync
+            self.socketio.emit('state_snapshot', self.state.snapshot(), to=request.sid)
+
+        @self.socketio.on('state_sync')
+        def handle_state_sync():
+            # Sent by a client that missed a delta
+            self.socketio.emit('state_snapshot', self.state.snapshot(), to=request.sid)
 
         @self.socketio.on('toggle_stream')
         def handle_toggle_stream(data):
             # handles streaming toggle slider button
-            self.stream_on = data.get('status', False)
-            print(f"Stream toggled: {'On' if self.stream_on else 'Off'}")
-            # Emit the updated stream state to all clients
-            self.socketio.emit('stream_state', {'status': self.stream_on})
+            self.update_state(stream_on=bool(data.get('status', False)))
+            logger.info("Stream toggled", extra=fields(status='On' if self.stream_on else 'Off'))
 
         @self.socketio.on('toggle_motors')
         def handle_toggle_motors(data):
             # handles motor toggle slider button
-            self.motors_on = data.get('status', False)
-            print(f"Motors toggled: {'On' if self.motors_on else 'Off'}")
-            # Emit the updated stream state to all clients
-            self.socketio.emit('motors_state', {'status': self.motors_on})
+            self.update_state(motors_on=bool(data.get('status', False)))
+            logger.info("Motors toggled", extra=fields(status='On' if self.motors_on else 'Off'))
 
         @self.socketio.on('toggle_lights')
         def handle_toggle_lights(data):
             # handles light toggle slider button
-            self.lights_on = data.get('status', False)
-            print(f"Light toggled: {'On' if self.lights_on else 'Off'}")
-            # Emit the updated stream state to all clients
-            self.socketio.emit('light_state', {'status': self.lights_on})
-            
+            self.update_state(lights_on=bool(data.get('status', False)))
+            logger.info("Light toggled", extra=fields(status='On' if self.lights_on else 'Off'))
+
             # Change the pin state
             if self.lights_on:
                 GPIO.output(self.led_pin, GPIO.HIGH)
             else:
                 GPIO.output(self.led_pin, GPIO.LOW)
 
-    def generate_frames(self):
+    @property
+    def stream_on(self):
+        return self.state.get('stream_on')
+
+    @property
+    def motors_on(self):
+        return self.state.get('motors_on')
+
+    @property
+    def lights_on(self):
+        return self.state.get('lights_on')
+
+    def update_state(self, **changes):
+        """
+        Change state fields and send the delta to all clients. Nothing is sent
+        if the values were already set.
+        """
+        delta = self.state.update(**changes)
+        if delta:
+            self.socketio.emit('state_delta', delta)
+        return delta
+
+    def set_bounding_boxes(self, bounding_boxes, camera_id=None, captured_at=None):
+        """
+        Feed new detections for a camera's stream (the default camera if no id is
+        given). Boxes follow their targets until they stop being detected.
+
+        Parameters:
+        bounding_boxes (list): Detections as returned by the model runner.
+        camera_id (str): Camera the detections belong to.
+        captured_at (float): time.monotonic() when the classified frame was captured. Defaults to now.
+        """
+        camera_id = camera_id or self.cameras.default_id
+        tracker = self.trackers.setdefault(camera_id, BoxTracker())
+        tracker.update(bounding_boxes, captured_at or time.monotonic())
+
+    def _stream(self, camera_id):
+        # One stream per camera, shared by all of its viewers
+        with self._streams_lock:
+            stream = self.streams.get(camera_id)
+            if stream is None:
+                tracker = self.trackers.setdefault(camera_id, BoxTracker())
+                stream = self.streams[camera_id] = CameraStream(self.cameras.get(camera_id), tracker)
+            return stream
+
+    def generate_frames(self, camera_id=None):
+        """
+        Multipart MJPEG stream of a camera. Frames are encoded once per camera
+        and shared by every viewer. Each part carries the frame's identity and
+        timing as headers, so the page can report when it showed it:
+        X-Stream-Id (this response), X-Frame-Seq (camera frame number) and
+        X-Capture-Time (server time.monotonic() when the frame left the camera).
+        """
+        camera_id = camera_id or self.cameras.default_id
+        worker = self.cameras.get(camera_id)
+        stream = self._stream(camera_id)
+        stream_id = next(self._stream_ids)
+        stream.viewer_joined()
+        try:
+            seq = -1
+            while worker.running:
+                seq, frame = stream.wait_frame(seq)
+                if frame is None:
+                    continue
+                try:
+                    item = frame.item
+                    jpeg_frame = item['jpeg']
+                    headers = (f"--frame\r\n"
+                               f"Content-Type: image/jpeg\r\n"
+                               f"Content-Length: {len(jpeg_frame)}\r\n"
+                               f"X-Stream-Id: {stream_id}\r\n"
+                               f"X-Frame-Seq: {item['seq']}\r\n"
+                               f"X-Capture-Time: {item['captured_at']:.6f}\r\n\r\n")
+                    self.latency.frame_sent(stream_id, item['seq'], item['captured_at'], item['published_at'],
+                                            item['picked_at'], item['encoded_at'], time.monotonic())
+                    # The server needs bytes, so this join is the one copy a frame gets per stream
+                    part = b''.join((headers.encode(), jpeg_frame, b'\r\n'))
+                finally:
+                    frame.release()
+                self.frames_sent.add()
+                yield part
+        finally:
+            stream.viewer_left()
+
+    def _is_admin(self, token):
+        if not self.admin_token or not token:
+            return False
+        # compare_digest only takes ASCII str, compare bytes so any token is just a mismatch
+        return hmac.compare_digest(str(token).encode(), self.admin_token.encode())
+
+    @staticmethod
+    def _profile_seconds(value):
+        # Profiling length from a client, 0.1-60 s. Raises ValueError for anything that isn't a number.
+        try:
+            seconds = float(value)
+        except (TypeError, ValueError):
+            raise ValueError("seconds must be a number")
+        if not math.isfinite(seconds):
+            raise ValueError("seconds must be a number")
+        return min(max(seconds, 0.1), 60)
+
+    def _run_profile(self, sid, seconds):
+        try:
+            result = self.profiler.run(seconds)
+        except ProfilerBusy as e:
+            result = {'error': str(e)}
+        self.socketio.emit('profile_result', result, to=sid)
+
+    def _reconfigure_camera(self, camera_id, settings):
+        # Returns the switch; wait on its done event, then call _camera_switched
+        return self.cameras.get(camera_id).reconfigure(**validate_settings(settings))
+
+    def _camera_switched(self):
+        # A failed switch can leave the camera stopped
+        self.update_state(cameras=self.cameras.running(), camera_settings=self.cameras.settings())
+
+    @staticmethod
+    def _wait_camera_switch(switch):
+        # Opening, a restart and a rollback each get switch.timeout; don't wait on a stuck capture loop forever
+        return switch.done.wait(switch.timeout * 3)
+
+    def _report_camera_switch(self, sid, camera_id, switch):
+        if not self._wait_camera_switch(switch):
+            self.socketio.emit('camera_config_result', {
+                'camera_id': camera_id, 'status': 'pending',
+                'error': "Camera is still switching, check /cameras for the result.",
+            }, to=sid)
+            return
+        self._camera_switched()
+        self.socketio.emit('camera_config_result', {'camera_id': camera_id, **switch.result}, to=sid)
+
+    def _push_telemetry(self):
+        # Sends each subscriber the samples taken since its last batch
         while True:
-            frame = self.camera_handler.get_still()
-            if frame is not None:
-                # Re-encode the modified image back to JPEG format
-                _, jpeg_frame = cv2.imencode('.jpg', frame)
-                modified_jpeg_frame = jpeg_frame.tobytes()
-                yield (b'--frame\r\n'
-                    b'Content-Type: image/jpeg\r\n\r\n' + modified_jpeg_frame + b'\r\n')
-            else:
-                print("Warning: No frame received from camera handler.")
-                time.sleep(0.1)  # Prevent a tight loop if no frames are received
+            now = time.monotonic()
+            with self._telemetry_lock:
+                due = [(sid, client) for sid, client in self._telemetry_clients.items()
+                       if client['next_push'] <= now]
+                for sid, client in due:
+                    client['next_push'] = now + client['interval']
+            for sid, client in due:
+                batch = self.telemetry.since(client['count'])
+                client['count'] = batch['count']
+                if batch['t']:
+                    self.socketio.emit('telemetry', batch, to=sid)
+            self.socketio.sleep(0.1)
 
-    def start(self):
-        self.socketio.run(self.app, host='0.0.0.0', port=5001, allow_unsafe_werkzeug=True)
+    def start(self, host='0.0.0.0', port=5001):
+        self.cameras.start()
+        self.update_state(cameras=self.cameras.running())
+        self.telemetry.start()
+        self.socketio.start_background_task(self._push_telemetry)
+        try:
+            self.socketio.run(self.app, host=host, port=port, allow_unsafe_werkzeug=True)
+        finally:
+            self.cameras.close()
 
 
 if __name__ == "__main__":
-    # GPIO18 shares same PWM channel as GPIO12
-    motor_driver = MotorDriver(in1_pin=24, in2_pin=23, ena_pin=12, in3_pin=22, in4_pin=27, enb_pin=18)
-    camera_driver = CameraHandler(width=960, height=540, fps=30)
-    web_server = RoverWebServer(motor_driver, camera_driver, 25)
+    setup_logging()
+    # GPIO18 shares same PWM channel as GPIO12, so this wiring uses software PWM.
+    # Moving ENB to GPIO13 lets pwm_backend='auto' use hardware PWM.
+    motor_driver = MotorDriver(in1_pin=24, in2_pin=23, ena_pin=12, in3_pin=22, in4_pin=27, enb_pin=18,
+                               profile_path=os.environ.get('ROVER_MIX_PROFILE', 'mix_profile.json'))
+    cameras = CameraRegistry()
+    cameras.add('front', width=960, height=540, fps=30, camera_index=0)
+    # Further cameras get their own stream at /video_feed/<camera_id>, e.g.
+    # cameras.add('rear', width=640, height=480, fps=30, camera_index=1, process=True)
+    # cameras.add('usb', width=640, height=480, fps=30, camera_index=0, source='opencv')
+    web_server = RoverWebServer(motor_driver, cameras, 25)
 
-    print("Initializing system...")
+    logger.info("Initializing system...")
     # TODO: Add any necessary initialization logic here:  
     # check battery voltage
     time.sleep(2)
-    print("Initialization complete. Starting webserver...")
-    web_server.start()
-    print("Web server started. Access the rover's control interface via the web browser on http://raspberrypi.local:5001")
\ No newline at end of file
+    logger.info("Initialization complete. Starting webserver. Access the rover's control interface via the web browser on http://raspberrypi.local:5001")
+    web_server.start()
\ No newline at end of file